@@ -0,0 +1,450 @@
+import argparse
+import json
+import os
+import zipfile
+from hashlib import md5
+
+from .exceptions import ScratchCompilerException
+from .sb3_project import Project
+from .target import json_default
+
+PROJECT_JSON_SIZE_LIMIT = 5 * 1024 * 1024  # Scratch refuses to save project.json files bigger than this
+ASSET_SIZE_LIMIT = 10 * 1024 * 1024  # Scratch refuses to upload assets bigger than this
+DEFAULT_SCRIPT_SIZE_LIMIT = 256 * 1024
+
+
+def serialized_size(value) -> int:
+    """
+    Calculates how many bytes a value takes inside project.json
+    uses the same encoding settings as Project.build_project_data
+    :param value: Any json serializable value
+    :return: Size in bytes
+    """
+    return len(json.dumps(value, default=json_default).encode("utf-8"))
+
+
+def entry_size(key: str, value, is_last: bool = False) -> int:
+    """
+    Calculates how many bytes a single '"key": value, ' entry of a json object takes
+    :param key: Key of the entry
+    :param value: Value of the entry
+    :param is_last: Defines if the entry is the last one of the object, which has no separator after it
+    :return: Size in bytes
+    """
+    return serialized_size(key) + len(": ") + serialized_size(value) + (0 if is_last else len(", "))
+
+
+def count_id_bytes(value, block_ids) -> int:
+    """
+    Counts bytes taken by block ID strings that are nested anywhere inside a value
+    :param value: Block data or part of it
+    :param block_ids: Collection of every block ID in the target
+    :return: Size in bytes of every ID string found
+    """
+    if isinstance(value, str):
+        return serialized_size(value) if value in block_ids else 0
+    if isinstance(value, list):
+        return sum(count_id_bytes(item, block_ids) for item in value)
+    if isinstance(value, dict):
+        return sum(count_id_bytes(item, block_ids) for item in value.values())
+    return 0
+
+
+def find_script_root(block_id: str, blocks: dict, roots: dict) -> str:
+    """
+    Follows the parent chain of a block until the top level block or an already resolved block is found,
+    so resolving every block of a target takes linear time
+    :param block_id: ID of the block to start from
+    :param blocks: Blocks dictionary of the target
+    :param roots: Top level block IDs of already resolved blocks, updated with every block of the chain
+    :return: ID of the top level block
+    """
+    chain = []
+    visited = set()
+    root_id = None
+    while root_id is None:
+        if block_id in roots:
+            root_id = roots[block_id]
+        elif block_id in visited:
+            root_id = block_id
+        else:
+            chain.append(block_id)
+            visited.add(block_id)
+            parent_id = blocks[block_id].get("parent") if isinstance(blocks[block_id], dict) else None
+            if parent_id is None or parent_id not in blocks:
+                root_id = block_id
+            block_id = parent_id
+    for chain_id in chain:
+        roots[chain_id] = root_id
+    return root_id
+
+
+class ScriptReport:
+    """
+        Size statistics of a single script, being a top level block and everything attached to it
+    """
+    def __init__(self, target_name: str, root_id: str, opcode: str):
+        self.target_name = target_name
+        self.root_id = root_id
+        self.opcode = opcode
+        self.block_count = 0
+        self.total_bytes = 0
+        self.id_bytes = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "target": self.target_name,
+            "rootId": self.root_id,
+            "opcode": self.opcode,
+            "blockCount": self.block_count,
+            "totalBytes": self.total_bytes,
+            "idBytes": self.id_bytes,
+            "payloadBytes": self.total_bytes - self.id_bytes
+        }
+
+
+class TargetReport:
+    """
+        Size statistics of a single target (sprite or stage)
+    """
+    def __init__(self, name: str, is_stage: bool):
+        self.name = name
+        self.is_stage = is_stage
+        self.total_bytes = 0
+        self.block_bytes = 0
+        self.id_bytes = 0
+        self.block_count = 0
+        self.section_bytes = {}
+        self.scripts = []
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "isStage": self.is_stage,
+            "totalBytes": self.total_bytes,
+            "blockBytes": self.block_bytes,
+            "blockCount": self.block_count,
+            "idBytes": self.id_bytes,
+            "payloadBytes": self.total_bytes - self.id_bytes,
+            "sections": self.section_bytes,
+            "scripts": [script.to_dict() for script in self.scripts]
+        }
+
+
+class OpcodeReport:
+    """
+        Size statistics of every block sharing the same opcode
+    """
+    def __init__(self, opcode: str):
+        self.opcode = opcode
+        self.count = 0
+        self.total_bytes = 0
+        self.id_bytes = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "opcode": self.opcode,
+            "count": self.count,
+            "totalBytes": self.total_bytes,
+            "idBytes": self.id_bytes,
+            "payloadBytes": self.total_bytes - self.id_bytes
+        }
+
+
+class AssetReport:
+    """
+        Size statistics of a single asset file and every costume or sound that uses it
+    """
+    def __init__(self, md5ext: str, size: int | None, content_hash: str | None, compressed_size: int | None = None):
+        self.md5ext = md5ext
+        self.size = size
+        self.compressed_size = compressed_size
+        self.content_hash = content_hash
+        self.references = []
+
+    def to_dict(self) -> dict:
+        return {
+            "md5ext": self.md5ext,
+            "size": self.size,
+            "compressedSize": self.compressed_size,
+            "contentHash": self.content_hash,
+            "references": self.references
+        }
+
+
+class ProjectReport:
+    """
+        Result of the project analysis, breaks down where the bytes of an .sb3 file go
+    """
+    def __init__(self, script_size_limit: int = DEFAULT_SCRIPT_SIZE_LIMIT):
+        """
+        :param script_size_limit: Scripts bigger than this amount of bytes get flagged as oversized
+        """
+        self.script_size_limit = script_size_limit
+        self.project_json_bytes = 0
+        self.targets = []
+        self.opcodes = {}
+        self.assets = {}
+
+    @property
+    def id_bytes(self) -> int:
+        return sum(target_report.id_bytes for target_report in self.targets)
+
+    @property
+    def asset_bytes(self) -> int:
+        return sum(asset.size or 0 for asset in self.assets.values())
+
+    @property
+    def oversized_scripts(self) -> [ScriptReport]:
+        """
+        :return: Scripts exceeding the script size limit, biggest first
+        """
+        scripts = [script for target_report in self.targets for script in target_report.scripts
+                   if script.total_bytes > self.script_size_limit]
+        return sorted(scripts, key=lambda script: script.total_bytes, reverse=True)
+
+    @property
+    def oversized_assets(self) -> [AssetReport]:
+        """
+        :return: Assets exceeding the scratch asset size limit
+        """
+        return [asset for asset in self.assets.values() if asset.size is not None and asset.size > ASSET_SIZE_LIMIT]
+
+    @property
+    def duplicate_assets(self) -> [dict]:
+        """
+        Groups assets that have identical content but are stored under different names,
+        a single file referenced by several costumes or sounds is already deduplicated and isn't reported
+        :return: List of duplicate groups with the amount of bytes that could be saved
+        """
+        by_content = {}
+        for asset in self.assets.values():
+            by_content.setdefault(asset.content_hash or asset.md5ext, []).append(asset)
+
+        duplicates = []
+        for content_hash, assets in by_content.items():
+            if len(assets) < 2:
+                continue
+            references = [reference for asset in assets for reference in asset.references]
+            duplicates.append({
+                "contentHash": content_hash,
+                "files": [asset.md5ext for asset in assets],
+                "references": references,
+                "wastedBytes": sum(asset.size or 0 for asset in assets[1:])
+            })
+        return duplicates
+
+    def to_dict(self) -> dict:
+        return {
+            "projectJsonBytes": self.project_json_bytes,
+            "projectJsonLimit": PROJECT_JSON_SIZE_LIMIT,
+            "idBytes": self.id_bytes,
+            "payloadBytes": self.project_json_bytes - self.id_bytes,
+            "assetBytes": self.asset_bytes,
+            "targets": [target_report.to_dict() for target_report in self.targets],
+            "opcodes": [opcode.to_dict() for opcode in
+                        sorted(self.opcodes.values(), key=lambda opcode: opcode.total_bytes, reverse=True)],
+            "assets": [asset.to_dict() for asset in self.assets.values()],
+            "duplicateAssets": self.duplicate_assets,
+            "oversizedScripts": [script.to_dict() for script in self.oversized_scripts],
+            "oversizedAssets": [asset.md5ext for asset in self.oversized_assets]
+        }
+
+    def to_json(self, indent: int | None = 2) -> str:
+        """
+        :param indent: Indentation passed to json.dumps
+        :return: The report as a json string
+        """
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_table(self, top: int = 10) -> str:
+        """
+        Formats the report as plain text tables
+        :param top: How many opcodes and scripts to list
+        :return: The report as a string
+        """
+        lines = [
+            f"project.json: {self.project_json_bytes} bytes "
+            f"({self.project_json_bytes / PROJECT_JSON_SIZE_LIMIT:.1%} of the {PROJECT_JSON_SIZE_LIMIT} byte limit)",
+            f"ID strings: {self.id_bytes} bytes, payload: {self.project_json_bytes - self.id_bytes} bytes",
+            f"Assets: {self.asset_bytes} bytes in {len(self.assets)} files",
+            "",
+            format_table(["Target", "Blocks", "Bytes", "Block bytes", "ID bytes"],
+                         [[target_report.name, target_report.block_count, target_report.total_bytes,
+                           target_report.block_bytes, target_report.id_bytes] for target_report in self.targets]),
+            "",
+            format_table(["Opcode", "Count", "Bytes", "ID bytes"],
+                         [[opcode.opcode, opcode.count, opcode.total_bytes, opcode.id_bytes] for opcode in
+                          sorted(self.opcodes.values(), key=lambda opcode: opcode.total_bytes, reverse=True)[:top]]),
+            "",
+            format_table(["Target", "Script", "Blocks", "Bytes", "ID bytes"],
+                         [[script.target_name, script.opcode, script.block_count, script.total_bytes, script.id_bytes]
+                          for script in sorted((script for target_report in self.targets
+                                                for script in target_report.scripts),
+                                               key=lambda script: script.total_bytes, reverse=True)[:top]]),
+            "",
+            format_table(["Asset", "Bytes", "Used by"],
+                         [[asset.md5ext, asset.size if asset.size is not None else "missing",
+                           ", ".join(asset.references)] for asset in
+                          sorted(self.assets.values(), key=lambda asset: asset.size or 0, reverse=True)])
+        ]
+
+        if self.project_json_bytes > PROJECT_JSON_SIZE_LIMIT:
+            lines.append(f"WARNING: project.json exceeds the {PROJECT_JSON_SIZE_LIMIT} byte limit!")
+        for script in self.oversized_scripts:
+            lines.append(f"WARNING: script '{script.opcode}' ({script.root_id}) in '{script.target_name}' "
+                         f"takes {script.total_bytes} bytes")
+        for asset in self.oversized_assets:
+            lines.append(f"WARNING: asset {asset.md5ext} exceeds the {ASSET_SIZE_LIMIT} byte limit")
+        for duplicate in self.duplicate_assets:
+            lines.append(f"DUPLICATE: {', '.join(duplicate['files'])} used by {', '.join(duplicate['references'])} "
+                         f"({duplicate['wastedBytes']} wasted bytes)")
+
+        return "\n".join(lines)
+
+
+def format_table(headers: [str], rows: [list]) -> str:
+    """
+    Formats rows into a text table with aligned columns
+    :param headers: Column names
+    :param rows: List of rows, each row being a list of values
+    :return: The table as a string
+    """
+    cells = [[str(header) for header in headers]] + [[str(value) for value in row] for row in rows]
+    widths = [max(len(row[column]) for row in cells) for column in range(len(headers))]
+    lines = ["  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in cells]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def analyze_project_data(project_data: dict, asset_reader=None,
+                         script_size_limit: int = DEFAULT_SCRIPT_SIZE_LIMIT) -> ProjectReport:
+    """
+    Analyzes the content of a project.json
+    :param project_data: Deserialized project.json
+    :param asset_reader: Function taking md5ext and returning (size, compressed_size, content_hash) or None if missing
+    :param script_size_limit: Scripts bigger than this amount of bytes get flagged as oversized
+    :return: The report
+    """
+    report = ProjectReport(script_size_limit=script_size_limit)
+    report.project_json_bytes = serialized_size(project_data)
+
+    for target_data in project_data.get("targets", []):
+        target_report = TargetReport(target_data.get("name", ""), target_data.get("isStage", False))
+        target_report.total_bytes = serialized_size(target_data)
+        last_key = next(reversed(target_data), None)
+        target_report.section_bytes = {key: entry_size(key, value, key == last_key)
+                                       for key, value in target_data.items()}
+
+        blocks = target_data.get("blocks", {})
+        last_block_id = next(reversed(blocks), None)
+        scripts = {}
+        roots = {}
+        for block_id, block_data in blocks.items():
+            block_bytes = entry_size(block_id, block_data, block_id == last_block_id)
+            id_bytes = serialized_size(block_id) + count_id_bytes(block_data, blocks)
+            # top level reporters are stored as lists instead of dictionaries
+            opcode = block_data.get("opcode", "") if isinstance(block_data, dict) else "<primitive>"
+
+            target_report.block_count += 1
+            target_report.block_bytes += block_bytes
+            target_report.id_bytes += id_bytes
+
+            opcode_report = report.opcodes.setdefault(opcode, OpcodeReport(opcode))
+            opcode_report.count += 1
+            opcode_report.total_bytes += block_bytes
+            opcode_report.id_bytes += id_bytes
+
+            root_id = find_script_root(block_id, blocks, roots)
+            if root_id not in scripts:
+                root_data = blocks[root_id]
+                root_opcode = root_data.get("opcode", "") if isinstance(root_data, dict) else "<primitive>"
+                scripts[root_id] = ScriptReport(target_report.name, root_id, root_opcode)
+            script = scripts[root_id]
+            script.block_count += 1
+            script.total_bytes += block_bytes
+            script.id_bytes += id_bytes
+
+        target_report.scripts = list(scripts.values())
+        report.targets.append(target_report)
+
+        for asset_data in target_data.get("costumes", []) + target_data.get("sounds", []):
+            md5ext = asset_data.get("md5ext", f"{asset_data.get('assetId')}.{asset_data.get('dataFormat')}")
+            asset = report.assets.get(md5ext)
+            if asset is None:
+                size, compressed_size, content_hash = (None, None, None)
+                if asset_reader is not None:
+                    size, compressed_size, content_hash = asset_reader(md5ext) or (None, None, None)
+                asset = AssetReport(md5ext, size, content_hash, compressed_size)
+                report.assets[md5ext] = asset
+            asset.references.append(f"{target_report.name}/{asset_data.get('name')}")
+
+    return report
+
+
+def analyze_project(project: Project, script_size_limit: int = DEFAULT_SCRIPT_SIZE_LIMIT) -> ProjectReport:
+    """
+    Analyzes a Project object without building it
+    :param project: The Project object
+    :param script_size_limit: Scripts bigger than this amount of bytes get flagged as oversized
+    :return: The report
+    """
+    assets = dict(project.iter_assets())
+
+    def read_asset(md5ext: str):
+        asset = assets.get(md5ext)
+        if asset is None:
+            return None
+        try:
+            with asset.source.open_buffer() as content:
+                return len(content), None, md5(content).hexdigest()
+        except OSError:
+            return None
+
+    return analyze_project_data(project.project_data, asset_reader=read_asset, script_size_limit=script_size_limit)
+
+
+def analyze_sb3(sb3_path: str, script_size_limit: int = DEFAULT_SCRIPT_SIZE_LIMIT) -> ProjectReport:
+    """
+    Analyzes an existing .sb3 file
+    :param sb3_path: Path to the .sb3 file
+    :param script_size_limit: Scripts bigger than this amount of bytes get flagged as oversized
+    :return: The report
+    """
+    if not os.path.exists(sb3_path):
+        raise FileNotFoundError(f"Project file {sb3_path} doesn't exist!")
+
+    with zipfile.ZipFile(sb3_path, "r") as zip_file:
+        names = set(zip_file.namelist())
+        if "project.json" not in names:
+            raise ScratchCompilerException(f"File {sb3_path} doesn't contain project.json!")
+        project_data = json.loads(zip_file.read("project.json"))
+
+        def read_asset(md5ext: str):
+            if md5ext not in names:
+                return None
+            info = zip_file.getinfo(md5ext)
+            return info.file_size, info.compress_size, md5(zip_file.read(md5ext)).hexdigest()
+
+        report = analyze_project_data(project_data, asset_reader=read_asset, script_size_limit=script_size_limit)
+        # the archive can store project.json with different separators, so use the real size
+        report.project_json_bytes = zip_file.getinfo("project.json").file_size
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shows where the bytes of an .sb3 project go")
+    parser.add_argument("sb3_path", help="Path to the .sb3 file")
+    parser.add_argument("--json", action="store_true", help="Print the report as json instead of tables")
+    parser.add_argument("--top", type=int, default=10, help="How many opcodes and scripts to list")
+    parser.add_argument("--script-size-limit", type=int, default=DEFAULT_SCRIPT_SIZE_LIMIT,
+                        help="Scripts bigger than this amount of bytes get flagged")
+    args = parser.parse_args()
+
+    report = analyze_sb3(args.sb3_path, script_size_limit=args.script_size_limit)
+    print(report.to_json() if args.json else report.to_table(top=args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import json
+import os
+import sqlite3
+import tempfile
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from uuid import uuid4
+
+from .exceptions import ScratchCompilerException
+from .target import StreamedValue
+
+
+class SqliteBlockStore:
+    """
+        Keeps block data of any amount of targets in an sqlite database on disk instead of python dictionaries.
+        Blocks are stored as json text, so serialization copies the text into project.json without decoding it,
+        only the most recently used blocks are kept decoded in memory.
+    """
+    def __init__(self, file_path: str | None = None, cache_size: int = 4096, batch_size: int = 1024):
+        """
+        :param file_path: Path of the database file, a temporary file removed on close is used if None
+        :param cache_size: How many decoded blocks are kept in memory
+        :param batch_size: How many blocks are written or read from the database at once
+        """
+        self.owns_file = file_path is None
+        if file_path is None:
+            file_descriptor, file_path = tempfile.mkstemp(suffix=".blocks.sqlite3")
+            os.close(file_descriptor)
+
+        self.file_path = file_path
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.cache = OrderedDict()
+        self.pending = {}
+
+        # builds can run in executor threads, sqlite itself serializes access to the connection
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        self.connection.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE IF NOT EXISTS blocks (
+                sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+                target TEXT NOT NULL,
+                block_id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                UNIQUE (target, block_id)
+            );
+            -- blocks of a target are read in insertion order without sorting them
+            CREATE INDEX IF NOT EXISTS blocks_target_sequence ON blocks (target, sequence);
+        """)
+
+    def flush(self):
+        """
+        Writes buffered blocks into the database
+        """
+        if not self.pending:
+            return
+        rows = [(target, block_id, data) for (target, block_id), data in self.pending.items()]
+        self.pending.clear()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO blocks (target, block_id, data) VALUES (?, ?, ?) "
+                "ON CONFLICT (target, block_id) DO UPDATE SET data = excluded.data", rows)
+
+    def remember(self, key: (str, str), block_data: dict):
+        self.cache[key] = block_data
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def put(self, target: str, block_id: str, block_data: dict | list):
+        """
+        :param target: Key of the target owning the block
+        :param block_id: ID of the block
+        :param block_data: Block data like Block.generate_data returns
+        """
+        key = (target, block_id)
+        self.pending[key] = json.dumps(block_data)
+        self.remember(key, block_data)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def put_many(self, target: str, blocks):
+        """
+        Stores blocks without keeping them decoded in memory
+        :param target: Key of the target owning the blocks
+        :param blocks: Iterable of (block id, block data) tuples
+        """
+        for block_id, block_data in blocks:
+            key = (target, block_id)
+            self.cache.pop(key, None)
+            self.pending[key] = json.dumps(block_data)
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def get(self, target: str, block_id: str) -> dict | list:
+        """
+        Returned block data is shared with the cache, put it back after changing it
+        :param target: Key of the target owning the block
+        :param block_id: ID of the block
+        :return: Block data
+        """
+        key = (target, block_id)
+        block_data = self.cache.get(key)
+        if block_data is not None:
+            self.cache.move_to_end(key)
+            return block_data
+
+        self.flush()
+        row = self.connection.execute("SELECT data FROM blocks WHERE target = ? AND block_id = ?", key).fetchone()
+        if row is None:
+            raise KeyError(block_id)
+        block_data = json.loads(row[0])
+        self.remember(key, block_data)
+        return block_data
+
+    def delete(self, target: str, block_id: str):
+        self.flush()
+        self.cache.pop((target, block_id), None)
+        with self.connection:
+            cursor = self.connection.execute("DELETE FROM blocks WHERE target = ? AND block_id = ?", (target, block_id))
+        if cursor.rowcount == 0:
+            raise KeyError(block_id)
+
+    def delete_target(self, target: str):
+        """
+        Removes every block of a target with a single statement
+        :param target: Key of the target
+        """
+        self.pending = {key: data for key, data in self.pending.items() if key[0] != target}
+        for key in [key for key in self.cache if key[0] == target]:
+            del self.cache[key]
+        with self.connection:
+            self.connection.execute("DELETE FROM blocks WHERE target = ?", (target,))
+
+    def contains(self, target: str, block_id: str) -> bool:
+        if (target, block_id) in self.cache or (target, block_id) in self.pending:
+            return True
+        row = self.connection.execute("SELECT 1 FROM blocks WHERE target = ? AND block_id = ?",
+                                      (target, block_id)).fetchone()
+        return row is not None
+
+    def count(self, target: str) -> int:
+        self.flush()
+        return self.connection.execute("SELECT COUNT(*) FROM blocks WHERE target = ?", (target,)).fetchone()[0]
+
+    def iter_rows(self, target: str):
+        """
+        Reads blocks of a target in the order they were first stored, batch by batch
+        :param target: Key of the target
+        :return: Generator of (block id, block json text) tuples
+        """
+        self.flush()
+        cursor = self.connection.execute("SELECT block_id, data FROM blocks WHERE target = ? ORDER BY sequence",
+                                         (target,))
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                return
+            yield from rows
+
+    def iter_json(self, target: str):
+        """
+        Encodes blocks of a target as a json object without decoding the stored block data
+        :param target: Key of the target
+        :return: Generator of json string chunks
+        """
+        yield "{"
+        separator = ""
+        batch = []
+        for block_id, data in self.iter_rows(target):
+            batch.append(f"{separator}{json.dumps(block_id)}: {data}")
+            separator = ", "
+            if len(batch) >= self.batch_size:
+                yield "".join(batch)
+                batch.clear()
+        yield "".join(batch)
+        yield "}"
+
+    def target_blocks(self, target: str | None = None) -> "StoredBlocks":
+        """
+        :param target: Key of the target, a new unique key is generated if None
+        :return: Dictionary-like view of the blocks of the target
+        """
+        return StoredBlocks(self, target or uuid4().hex)
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+        if self.owns_file:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.file_path + suffix):
+                    os.remove(self.file_path + suffix)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __getstate__(self):
+        # worker processes of parallel serialization open the same database file
+        if self.owns_file:
+            raise ScratchCompilerException("Block store using a temporary file can't be shared with other processes!")
+        self.flush()
+        return {"file_path": self.file_path, "cache_size": self.cache_size, "batch_size": self.batch_size}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state["file_path"], cache_size=state["cache_size"], batch_size=state["batch_size"])
+
+
+class StoredBlocks(StreamedValue, MutableMapping):
+    """
+        Replacement of the sprite data "blocks" dictionary that keeps blocks inside a SqliteBlockStore
+    """
+    def __init__(self, store: SqliteBlockStore, target: str):
+        """
+        :param store: The block store
+        :param target: Key of the target inside the store
+        """
+        self.store = store
+        self.target = target
+
+    def update_from(self, blocks):
+        """
+        Stores many blocks at once without keeping them in memory
+        :param blocks: Iterable of (block id, block data) tuples
+        """
+        self.store.put_many(self.target, blocks)
+
+    def clear(self):
+        self.store.delete_target(self.target)
+
+    def iter_json(self):
+        return self.store.iter_json(self.target)
+
+    def to_json_value(self) -> dict:
+        return dict(self.items())
+
+    def items(self):
+        for block_id, data in self.store.iter_rows(self.target):
+            yield block_id, json.loads(data)
+
+    def __getitem__(self, block_id: str):
+        return self.store.get(self.target, block_id)
+
+    def __setitem__(self, block_id: str, block_data: dict | list):
+        self.store.put(self.target, block_id, block_data)
+
+    def __delitem__(self, block_id: str):
+        self.store.delete(self.target, block_id)
+
+    def __contains__(self, block_id) -> bool:
+        return isinstance(block_id, str) and self.store.contains(self.target, block_id)
+
+    def __iter__(self):
+        return (block_id for block_id, _ in self.store.iter_rows(self.target))
+
+    def __len__(self) -> int:
+        return self.store.count(self.target)
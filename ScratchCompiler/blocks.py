@@ -49,6 +49,10 @@ class LiteralType(IntEnum):
     SCENE_NUMBER = 18  # Backdrop index value
 
 
+# LiteralType values used by scratch for broadcast menus inside inputs
+BROADCAST_PRIMITIVE = 11
+
+
 class BlockType(StrEnum):
     """
         Enum class for every type of block inside scratch.
@@ -102,21 +106,54 @@ class Definitions:
     CHANGE_VARIABLE_BY = BlockDefinition("data_changevariableby", inputs=["VALUE"], fields=["VARIABLE"], block_type=BlockType.COMMAND)
 
     LOOKS_SET_SIZE_TO = BlockDefinition("looks_setsizeto", inputs=["SIZE"], block_type=BlockType.COMMAND)
+    NEXT_COSTUME = BlockDefinition("looks_nextcostume", block_type=BlockType.COMMAND)
 
     MATH_ADD = BlockDefinition("operator_add", inputs=["NUM1", "NUM2"], block_type=BlockType.REPORTER)
+    MATH_SUBTRACT = BlockDefinition("operator_subtract", inputs=["NUM1", "NUM2"], block_type=BlockType.REPORTER)
+    MATH_MULTIPLY = BlockDefinition("operator_multiply", inputs=["NUM1", "NUM2"], block_type=BlockType.REPORTER)
+    MATH_DIVIDE = BlockDefinition("operator_divide", inputs=["NUM1", "NUM2"], block_type=BlockType.REPORTER)
+    OPERATOR_JOIN = BlockDefinition("operator_join", inputs=["STRING1", "STRING2"], block_type=BlockType.REPORTER)
 
     OPERATOR_GT = BlockDefinition("operator_gt", inputs=["OPERAND1", "OPERAND2"], block_type=BlockType.BOOLEAN)
+    OPERATOR_LT = BlockDefinition("operator_lt", inputs=["OPERAND1", "OPERAND2"], block_type=BlockType.BOOLEAN)
+    OPERATOR_EQUALS = BlockDefinition("operator_equals", inputs=["OPERAND1", "OPERAND2"], block_type=BlockType.BOOLEAN)
 
     CONTROL_IF = BlockDefinition("control_if", inputs=["CONDITION", "SUBSTACK"], block_type=BlockType.COMMAND)
+    CONTROL_IF_ELSE = BlockDefinition("control_if_else", inputs=["CONDITION", "SUBSTACK", "SUBSTACK2"],
+                                      block_type=BlockType.COMMAND)
     CONTROL_REPEAT = BlockDefinition("control_repeat", inputs=["TIMES", "SUBSTACK"], block_type=BlockType.COMMAND)
     CONTROL_REPEAT_UNTIL = BlockDefinition("control_repeat_until", inputs=["SUBSTACK", "CONDITION"], block_type=BlockType.COMMAND)
     CONTROL_FOREVER = BlockDefinition("control_forever", inputs=["SUBSTACK"], block_type=BlockType.CAP)
+    CONTROL_WAIT = BlockDefinition("control_wait", inputs=["DURATION"], block_type=BlockType.COMMAND)
+
+    WHEN_BROADCAST_RECEIVED = BlockDefinition("event_whenbroadcastreceived", fields=["BROADCAST_OPTION"],
+                                              block_type=BlockType.HAT)
+    BROADCAST = BlockDefinition("event_broadcast", inputs=["BROADCAST_INPUT"], block_type=BlockType.COMMAND)
+    BROADCAST_AND_WAIT = BlockDefinition("event_broadcastandwait", inputs=["BROADCAST_INPUT"],
+                                         block_type=BlockType.COMMAND)
+
+    ADD_TO_LIST = BlockDefinition("data_addtolist", inputs=["ITEM"], fields=["LIST"], block_type=BlockType.COMMAND)
+    DELETE_OF_LIST = BlockDefinition("data_deleteoflist", inputs=["INDEX"], fields=["LIST"], block_type=BlockType.COMMAND)
+    DELETE_ALL_OF_LIST = BlockDefinition("data_deletealloflist", fields=["LIST"], block_type=BlockType.COMMAND)
+    INSERT_AT_LIST = BlockDefinition("data_insertatlist", inputs=["ITEM", "INDEX"], fields=["LIST"],
+                                     block_type=BlockType.COMMAND)
+    REPLACE_ITEM_OF_LIST = BlockDefinition("data_replaceitemoflist", inputs=["INDEX", "ITEM"], fields=["LIST"],
+                                           block_type=BlockType.COMMAND)
+    ITEM_OF_LIST = BlockDefinition("data_itemoflist", inputs=["INDEX"], fields=["LIST"], block_type=BlockType.REPORTER)
+    ITEM_NUM_OF_LIST = BlockDefinition("data_itemnumoflist", inputs=["ITEM"], fields=["LIST"],
+                                       block_type=BlockType.REPORTER)
+    LENGTH_OF_LIST = BlockDefinition("data_lengthoflist", fields=["LIST"], block_type=BlockType.REPORTER)
+    LIST_CONTAINS_ITEM = BlockDefinition("data_listcontainsitem", inputs=["ITEM"], fields=["LIST"],
+                                         block_type=BlockType.BOOLEAN)
+    SHOW_LIST = BlockDefinition("data_showlist", fields=["LIST"], block_type=BlockType.COMMAND)
+    HIDE_LIST = BlockDefinition("data_hidelist", fields=["LIST"], block_type=BlockType.COMMAND)
 
 
 class Reference:
     """
         Base class for any type of LiteralType reference
     """
+    field_compatible = False  # Defines if the reference can be used inside FieldInput
 
     def generate_reference(self) -> list:
         """
@@ -125,11 +162,20 @@ class Reference:
         """
         return []
 
+    def register_use(self, block: "Block", reference_data: list) -> None:
+        """
+        Called when generated reference gets set as an input or field of a block
+        :param block: The block using the reference
+        :param reference_data: List returned by generate_reference, stored inside the block data
+        """
+        pass
+
 
 class VariableReference(Reference):
     """
         Used for creating a reference to a variable for both normal Input and FieldInput
     """
+    field_compatible = True
 
     def __init__(self, variable_name: str, is_field_selector: bool = False):
         """
@@ -149,6 +195,30 @@ class VariableReference(Reference):
         ]
 
 
+class ListReference(Reference):
+    """
+        Used for creating a reference to a list for both normal Input and FieldInput
+    """
+    field_compatible = True
+
+    def __init__(self, list_name: str, is_field_selector: bool = False):
+        """
+        :param list_name: Name of list to refer to
+        :param is_field_selector: Defines if reference used in a field
+        """
+        self.list_name = list_name
+        self.is_field_selector = is_field_selector
+
+    def generate_reference(self) -> list:
+        if self.is_field_selector:
+            return [self.list_name, self.list_name]
+        return [
+            InputType.SHADOW_OVERRIDDEN,
+            [LiteralType.LIST_REFERENCE, self.list_name, self.list_name],
+            [LiteralType.NUMBER_LITERAL, 0]
+        ]
+
+
 class SubstackReference(Reference):
     """
         Used for creating a reference to a substack of blocks; Used for blocks that branch off to different blocks.
@@ -254,7 +324,7 @@ class FieldInput(Input):
             raise ScratchCompilerException("Field value cannot be set to a number literal!")
 
     def generate_input(self) -> list:
-        if isinstance(self.value, VariableReference):
+        if isinstance(self.value, Reference) and self.value.field_compatible:
             return self.value.generate_reference()
 
         raise ScratchCompilerException(
@@ -327,6 +397,9 @@ class Block:
 
         self.input_values[input_name] = input_value.generate_input()
 
+        if input_value.use_reference:
+            input_value.value.register_use(self, self.input_values[input_name])
+
     def set_field_value(self, field_name: str, field_value: FieldInput):
         """
         Sets the field value of a block
@@ -339,6 +412,9 @@ class Block:
 
         self.field_values[field_name] = field_value.generate_input()
 
+        if field_value.use_reference:
+            field_value.value.register_use(self, self.field_values[field_name])
+
     def set_parent(self, parent_block: "Block", auto_set_child: bool = True):
         """
         Sets the parent of the block
@@ -3,3 +3,20 @@ class ScratchCompilerException(Exception):
         Exception thrown in the whole ScratchCompiler package if something goes wrong
     """
     pass
+
+
+class RequestRejectedException(ScratchCompilerException):
+    """
+        Exception thrown by the build service when a request isn't valid or isn't allowed, before anything is built
+    """
+    def __init__(self, message: str, status: int = 403):
+        """
+        :param message: Why the request was rejected
+        :param status: HTTP status of the response, 400 for invalid and 403 for forbidden requests
+        """
+        self.status = status
+        super().__init__(message)
+
+    def __reduce__(self):
+        # requests are checked inside worker processes, the status has to survive pickling
+        return type(self), (str(self), self.status)
@@ -0,0 +1,201 @@
+import re
+import struct
+
+from .exceptions import ScratchCompilerException
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPG_SIGNATURE = b"\xff\xd8"
+
+# svg root element has to start within this many bytes, it is usually preceded only by a short xml prolog
+SVG_HEADER_LIMIT = 65536
+SVG_READ_SIZE = 1024
+
+SVG_ROOT_PATTERN = re.compile(rb"<svg[\s>]")
+SVG_ATTRIBUTE_PATTERN = re.compile(r"([\w:.-]+)\s*=\s*([\"'])(.*?)\2", re.DOTALL)
+SVG_LENGTH_PATTERN = re.compile(r"^\s*([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)\s*(?:px)?\s*$")
+
+# start of frame markers holding the jpg dimensions, 0xc4, 0xc8 and 0xcc use the same range for other segments
+JPG_SOF_MARKERS = frozenset(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+# markers without a length
+JPG_STANDALONE_MARKERS = frozenset(range(0xd0, 0xda)) | {0x01}
+
+
+class BufferReader:
+    """
+        Read only binary file interface over a buffer, only the bytes that are read get copied
+    """
+    def __init__(self, buffer: memoryview):
+        """
+        :param buffer: Byte buffer
+        """
+        self.buffer = buffer
+        self.position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self.buffer) if size < 0 else min(self.position + size, len(self.buffer))
+        data = bytes(self.buffer[self.position:end])
+        self.position = max(self.position, end)
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = (0, self.position, len(self.buffer))[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+
+class ImageInfo:
+    """
+        Format and dimensions of an image read from its header
+    """
+    def __init__(self, data_format: str, width: float, height: float):
+        """
+        :param data_format: Format of the image as used in project.json, "png", "jpg" or "svg"
+        :param width: Width in pixels, for svg in user units of the viewBox
+        :param height: Height in pixels, for svg in user units of the viewBox
+        """
+        self.data_format = data_format
+        self.width = width
+        self.height = height
+
+    @property
+    def center(self) -> (float, float):
+        """
+        :return: Center of the image usable as a rotation center
+        """
+        return tuple(size // 2 if size % 2 == 0 else size / 2 for size in (self.width, self.height))
+
+    def __repr__(self):
+        return f"ImageInfo({self.data_format!r}, {self.width}x{self.height})"
+
+
+def read_png_info(image_file) -> ImageInfo:
+    """
+    Reads only the IHDR chunk, which has to follow the signature directly
+    :param image_file: Binary file positioned after the png signature
+    :return: ImageInfo of the image
+    """
+    header = image_file.read(16)
+    if len(header) < 16 or header[4:8] != b"IHDR":
+        raise ScratchCompilerException("Png image has no IHDR chunk!")
+    width, height = struct.unpack(">II", header[8:16])
+    return ImageInfo("png", width, height)
+
+
+def read_jpg_info(image_file) -> ImageInfo:
+    """
+    Walks segment headers until the start of frame, skipping segment contents without reading them
+    :param image_file: Binary file positioned after the jpg signature
+    :return: ImageInfo of the image
+    """
+    while True:
+        marker = image_file.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            raise ScratchCompilerException("Jpg image has no start of frame segment!")
+        # markers can be padded with any amount of 0xff bytes
+        while marker[1] == 0xff:
+            marker = marker[1:] + image_file.read(1)
+            if len(marker) < 2:
+                raise ScratchCompilerException("Jpg image has no start of frame segment!")
+        if marker[1] in JPG_STANDALONE_MARKERS:
+            continue
+
+        length_data = image_file.read(2)
+        if len(length_data) < 2:
+            raise ScratchCompilerException("Jpg image has no start of frame segment!")
+        length = struct.unpack(">H", length_data)[0]
+        if marker[1] in JPG_SOF_MARKERS:
+            frame_header = image_file.read(5)
+            if len(frame_header) < 5:
+                raise ScratchCompilerException("Jpg start of frame segment is truncated!")
+            height, width = struct.unpack(">HH", frame_header[1:5])
+            return ImageInfo("jpg", width, height)
+        image_file.seek(length - 2, 1)
+
+
+def parse_svg_length(value: str | None) -> float | None:
+    """
+    :param value: Value of a width or height attribute
+    :return: Length in pixels or None if it's missing or uses units relative to something else, like %
+    """
+    if value is None:
+        return None
+    match = SVG_LENGTH_PATTERN.match(value)
+    return float(match.group(1)) if match is not None else None
+
+
+def read_svg_info(image_file, start: bytes = b"") -> ImageInfo:
+    """
+    Reads the file only until the svg root element is closed.
+    Dimensions come from the viewBox like scratch measures svg costumes, width and height are used without one
+    :param image_file: Binary file
+    :param start: Bytes already read from the start of the file
+    :return: ImageInfo of the image
+    """
+    header = start
+    root_start = -1
+    while len(header) < SVG_HEADER_LIMIT:
+        if root_start < 0:
+            match = SVG_ROOT_PATTERN.search(header)
+            root_start = match.start() if match is not None else -1
+        if root_start >= 0 and header.find(b">", root_start) >= 0:
+            break
+        data = image_file.read(SVG_READ_SIZE)
+        if not data:
+            break
+        header += data
+
+    root_end = header.find(b">", root_start) if root_start >= 0 else -1
+    if root_end < 0:
+        raise ScratchCompilerException("Svg root element wasn't found at the start of the image!")
+
+    root = header[root_start:root_end].decode("utf-8", errors="replace")
+    attributes = {name: value for name, _, value in SVG_ATTRIBUTE_PATTERN.findall(root)}
+
+    view_box = attributes.get("viewBox")
+    if view_box is not None:
+        values = view_box.replace(",", " ").split()
+        try:
+            _, _, width, height = (float(value) for value in values)
+        except ValueError:
+            raise ScratchCompilerException(f"Svg has an invalid viewBox '{view_box}'!") from None
+        return ImageInfo("svg", width, height)
+
+    width = parse_svg_length(attributes.get("width"))
+    height = parse_svg_length(attributes.get("height"))
+    if width is None or height is None:
+        raise ScratchCompilerException("Svg has neither a viewBox nor a width and height in pixels!")
+    return ImageInfo("svg", width, height)
+
+
+def detect_image_format(start: bytes) -> str | None:
+    """
+    Detects the image format from its file signature, without reading the dimensions
+    :param start: First bytes of the image, at least the length of the png signature
+    :return: "png", "jpg", "svg" or None if the format is unknown
+    """
+    if start.startswith(PNG_SIGNATURE):
+        return "png"
+    if start.startswith(JPG_SIGNATURE):
+        return "jpg"
+    text_start = start.removeprefix(b"\xef\xbb\xbf").lstrip()
+    if text_start.startswith(b"<") or not text_start:
+        return "svg"
+    return None
+
+
+def read_image_info(image_file) -> ImageInfo:
+    """
+    Detects the image format from its first bytes and reads only the header holding the dimensions
+    :param image_file: Binary file positioned at the start of the image
+    :return: ImageInfo of the image
+    """
+    start = image_file.read(len(PNG_SIGNATURE))
+    data_format = detect_image_format(start)
+    if data_format == "png":
+        return read_png_info(image_file)
+    if data_format == "jpg":
+        image_file.seek(len(JPG_SIGNATURE) - len(start), 1)
+        return read_jpg_info(image_file)
+    if data_format == "svg":
+        return read_svg_info(image_file, start)
+    raise ScratchCompilerException("Image isn't a png, jpg or svg!")
@@ -0,0 +1,421 @@
+import gzip
+import io
+import json
+import os
+import zipfile
+from enum import IntEnum
+from hashlib import sha256
+
+from .blocks import InputType, LiteralType
+from .exceptions import ScratchCompilerException
+from .sb3_project import Project, dump_project_data
+from .target import Costume, Sprite, Stage
+
+IR_FORMAT = "typescratch-ir"
+IR_VERSION = 1
+NO_BLOCK = -1
+
+
+class IRInputKind(IntEnum):
+    """
+        Kinds of rows inside the IR inputs table, see IR.md
+    """
+    NUMBER = 0
+    STRING = 1
+    BLOCK = 2
+    SUBSTACK = 3
+    VARIABLE = 4
+    LIST = 5
+
+
+class IRFieldKind(IntEnum):
+    """
+        Kinds of rows inside the IR fields table, see IR.md
+    """
+    VARIABLE = 0
+    LIST = 1
+
+
+def ir_block_id(block_index: int) -> str:
+    """
+    Generates a short block ID from the index of a block in the IR blocks table
+    :param block_index: Index of the block
+    :return: Block ID used in project.json
+    """
+    return f"b{block_index:x}"
+
+
+class IRBuilder:
+    """
+        Helper for generating IR tables, blocks are always added to the last added target
+    """
+    def __init__(self):
+        self.opcodes = []
+        self.opcode_indexes = {}
+        self.assets = []
+        self.targets = []
+        self.blocks = []
+        self.inputs = []
+        self.fields = []
+
+    def add_asset(self, name: str, file_path: str, data_format: str | None, bitmap_resolution: int = 1,
+                  px_pivot: tuple | None = None) -> int:
+        """
+        :param name: Name of the costume
+        :param file_path: Path to the image, relative paths are resolved against the base path given to the loader
+        :param data_format: Format of the image, detected from the image header if None
+        :param bitmap_resolution: The resolution of an image
+        :param px_pivot: Rotation center of the image, the center of the image if None
+        :return: Index of the asset
+        """
+        pivot_x, pivot_y = px_pivot if px_pivot is not None else (None, None)
+        self.assets.append([name, file_path, data_format, bitmap_resolution, pivot_x, pivot_y])
+        return len(self.assets) - 1
+
+    def add_target(self, name: str, is_stage: bool = False, costumes: [int] = (), variables: dict = None,
+                   lists: dict = None, properties: dict = None) -> int:
+        """
+        :param name: Name of the sprite, ignored for the stage
+        :param is_stage: Defines if the target is the stage
+        :param costumes: Indexes of assets used as costumes
+        :param variables: Dictionary of variable name to initial value
+        :param lists: Dictionary of list name to initial contents
+        :param properties: Properties set with Sprite.set_property
+        :return: Index of the target
+        """
+        self.targets.append({
+            "name": name,
+            "isStage": is_stage,
+            "costumes": list(costumes),
+            "variables": variables or {},
+            "lists": lists or {},
+            "properties": properties or {},
+            "blocks": [len(self.blocks), 0]
+        })
+        return len(self.targets) - 1
+
+    def add_block(self, opcode: str, parent: int = NO_BLOCK, next_block: int = NO_BLOCK) -> int:
+        """
+        :param opcode: Opcode of the block
+        :param parent: Index of the parent block
+        :param next_block: Index of the next block
+        :return: Index of the block
+        """
+        if not self.targets:
+            raise ScratchCompilerException("Blocks can't be added before a target is added!")
+
+        opcode_index = self.opcode_indexes.get(opcode)
+        if opcode_index is None:
+            opcode_index = self.opcode_indexes[opcode] = len(self.opcodes)
+            self.opcodes.append(opcode)
+
+        self.blocks.append([opcode_index, parent, next_block])
+        self.targets[-1]["blocks"][1] += 1
+        return len(self.blocks) - 1
+
+    def add_stack(self, opcodes: [str]) -> [int]:
+        """
+        Adds blocks that follow each other
+        :param opcodes: Opcodes of the blocks in order
+        :return: Indexes of the blocks
+        """
+        indexes = [self.add_block(opcode) for opcode in opcodes]
+        self.chain(indexes)
+        return indexes
+
+    def chain(self, blocks: [int]) -> None:
+        """
+        Sets parent and next of blocks, so they follow each other
+        :param blocks: Indexes of the blocks in order
+        """
+        for parent, child in zip(blocks, blocks[1:]):
+            self.blocks[parent][2] = child
+            self.blocks[child][1] = parent
+
+    def add_input(self, block: int, name: str, kind: IRInputKind, value) -> None:
+        """
+        :param block: Index of the block
+        :param name: Name of the input
+        :param kind: Kind of the input
+        :param value: Literal value, variable or list name, or index of the block for BLOCK and SUBSTACK
+        """
+        if kind in (IRInputKind.BLOCK, IRInputKind.SUBSTACK):
+            self.blocks[value][1] = block
+        self.inputs.append([block, name, int(kind), value])
+
+    def add_field(self, block: int, name: str, kind: IRFieldKind, value: str) -> None:
+        """
+        :param block: Index of the block
+        :param name: Name of the field
+        :param kind: Kind of the field
+        :param value: Variable or list name
+        """
+        self.fields.append([block, name, int(kind), value])
+
+    def to_dict(self) -> dict:
+        """
+        :return: The IR as a json serializable dictionary
+        """
+        return {
+            "format": IR_FORMAT,
+            "version": IR_VERSION,
+            "opcodes": self.opcodes,
+            "assets": self.assets,
+            "targets": self.targets,
+            "blocks": self.blocks,
+            "inputs": self.inputs,
+            "fields": self.fields
+        }
+
+
+def validate_ir(ir: dict) -> None:
+    """
+    Checks the header and table references of an IR dictionary
+    :param ir: The IR
+    """
+    if ir.get("format") != IR_FORMAT:
+        raise ScratchCompilerException(f"Not a {IR_FORMAT} file, format: {ir.get('format')}")
+    if ir.get("version") != IR_VERSION:
+        raise ScratchCompilerException(f"Unsupported IR version {ir.get('version')}, expected {IR_VERSION}")
+
+    for table in ("opcodes", "assets", "targets", "blocks", "inputs", "fields"):
+        if not isinstance(ir.get(table), list):
+            raise ScratchCompilerException(f"IR table '{table}' is missing or isn't a list!")
+
+    block_count = len(ir["blocks"])
+    # index of the target owning each block, links between blocks can't cross targets
+    block_owners = [None] * block_count
+    for target_index, target_ir in enumerate(ir["targets"]):
+        start, count = target_ir["blocks"]
+        if start < 0 or count < 0 or start + count > block_count:
+            raise ScratchCompilerException(f"Target {target_index} block range {start}:{start + count} is out of bounds!")
+        for block_index in range(start, start + count):
+            if block_owners[block_index] is not None:
+                raise ScratchCompilerException(
+                    f"Target {target_index} block range {start}:{start + count} overlaps target "
+                    f"{block_owners[block_index]}!")
+            block_owners[block_index] = target_index
+        for asset_index in target_ir.get("costumes", []):
+            if not 0 <= asset_index < len(ir["assets"]):
+                raise ScratchCompilerException(f"Target {target_index} uses asset {asset_index} which doesn't exist!")
+
+    opcode_count = len(ir["opcodes"])
+    for block_index, (opcode_index, parent, next_block, *_) in enumerate(ir["blocks"]):
+        if not 0 <= opcode_index < opcode_count:
+            raise ScratchCompilerException(f"Block {block_index} uses opcode {opcode_index} which doesn't exist!")
+        for linked_block in (parent, next_block):
+            if linked_block == NO_BLOCK:
+                continue
+            if not 0 <= linked_block < block_count:
+                raise ScratchCompilerException(f"Block {block_index} refers to a block that doesn't exist!")
+            if block_owners[linked_block] != block_owners[block_index]:
+                raise ScratchCompilerException(f"Block {block_index} refers to block {linked_block} of another target!")
+
+    for table in ("inputs", "fields"):
+        for row in ir[table]:
+            if not 0 <= row[0] < block_count:
+                raise ScratchCompilerException(f"Row {row} of IR table '{table}' refers to a block that doesn't exist!")
+
+    for row in ir["inputs"]:
+        if row[2] not in (IRInputKind.BLOCK, IRInputKind.SUBSTACK):
+            continue
+        if not isinstance(row[3], int) or not 0 <= row[3] < block_count:
+            raise ScratchCompilerException(f"Input row {row} refers to a block that doesn't exist!")
+        if block_owners[row[3]] != block_owners[row[0]]:
+            raise ScratchCompilerException(f"Input row {row} refers to a block of another target!")
+
+
+def generate_input(kind: int, value, block_ids: [str]) -> list:
+    """
+    Generates the scratch input list for an IR input row, matches what Input.generate_input returns
+    :param kind: IRInputKind of the row
+    :param value: Value of the row
+    :param block_ids: Block IDs by block index
+    :return: Scratch input data list
+    """
+    if kind == IRInputKind.NUMBER:
+        return [InputType.LITERAL, [LiteralType.NUMBER_LITERAL, value]]
+    if kind == IRInputKind.STRING:
+        return [InputType.LITERAL, [LiteralType.STRING_LITERAL, value]]
+    if kind == IRInputKind.BLOCK:
+        return [InputType.SHADOW_OVERRIDDEN, block_ids[value], [LiteralType.NUMBER_LITERAL, "0"]]
+    if kind == IRInputKind.SUBSTACK:
+        return [InputType.BLOCK_INPUT, block_ids[value]]
+    if kind == IRInputKind.VARIABLE:
+        return [InputType.SHADOW_OVERRIDDEN, [LiteralType.VARIABLE_REFERENCE, value, value],
+                [LiteralType.NUMBER_LITERAL, 0]]
+    if kind == IRInputKind.LIST:
+        return [InputType.SHADOW_OVERRIDDEN, [LiteralType.LIST_REFERENCE, value, value],
+                [LiteralType.NUMBER_LITERAL, 0]]
+    raise ScratchCompilerException(f"Unknown IR input kind {kind}!")
+
+
+def iter_blocks_data(ir: dict, start: int, count: int, block_ids: [str], inputs_by_block: dict,
+                     fields_by_block: dict):
+    """
+    Generates block data of one target straight from the IR tables
+    :param ir: The IR
+    :param start: Index of the first block of the target
+    :param count: Amount of blocks of the target
+    :param block_ids: Block IDs by block index
+    :param inputs_by_block: IR input rows grouped by block index
+    :param fields_by_block: IR field rows grouped by block index
+    :return: Generator of (block id, block data) tuples
+    """
+    opcodes = ir["opcodes"]
+
+    for block_index in range(start, start + count):
+        opcode_index, parent, next_block, *position = ir["blocks"][block_index]
+
+        block_data = {
+            "opcode": opcodes[opcode_index],
+            "next": block_ids[next_block] if next_block != NO_BLOCK else None,
+            "parent": block_ids[parent] if parent != NO_BLOCK else None,
+            "inputs": {name: generate_input(kind, value, block_ids)
+                       for _, name, kind, value in inputs_by_block.get(block_index, ())},
+            "fields": {name: [value, value] for _, name, kind, value in fields_by_block.get(block_index, ())},
+            "shadow": False,
+            "topLevel": parent == NO_BLOCK,
+        }
+
+        if parent == NO_BLOCK:
+            block_data["x"] = position[0] if len(position) > 0 else 0
+            block_data["y"] = position[1] if len(position) > 1 else 0
+
+        yield block_ids[block_index], block_data
+
+
+def iter_ir_targets(ir: dict, base_path: str | None = None, block_store=None):
+    """
+    Turns IR targets into Sprite and Stage objects one by one, validates the IR first
+    :param ir: The IR
+    :param base_path: Directory relative asset paths are resolved against, current directory if None
+    :param block_store: SqliteBlockStore blocks are written into instead of dictionaries
+    :return: Generator of Sprite objects
+    """
+    validate_ir(ir)
+
+    block_ids = [ir_block_id(block_index) for block_index in range(len(ir["blocks"]))]
+    inputs_by_block = {}
+    for row in ir["inputs"]:
+        inputs_by_block.setdefault(row[0], []).append(row)
+    fields_by_block = {}
+    for row in ir["fields"]:
+        fields_by_block.setdefault(row[0], []).append(row)
+
+    costumes = {}
+    for target_ir in ir["targets"]:
+        sprite = Stage() if target_ir.get("isStage", False) else Sprite(name=target_ir["name"])
+
+        for asset_index in target_ir.get("costumes", []):
+            if asset_index not in costumes:
+                name, file_path, data_format, bitmap_resolution, pivot_x, pivot_y = ir["assets"][asset_index]
+                if base_path is not None and not os.path.isabs(file_path):
+                    file_path = os.path.join(base_path, file_path)
+                px_pivot = (pivot_x, pivot_y) if pivot_x is not None and pivot_y is not None else None
+                costumes[asset_index] = Costume(file_path=file_path, data_format=data_format, name=name,
+                                                bitmap_resolution=bitmap_resolution, px_pivot=px_pivot)
+            sprite.add_costume(costumes[asset_index])
+
+        for variable_name, default_value in target_ir.get("variables", {}).items():
+            sprite.create_variable(variable_name, default_value)
+        for list_name, values in target_ir.get("lists", {}).items():
+            sprite.create_list(list_name, values)
+        for sprite_property, value in target_ir.get("properties", {}).items():
+            sprite.set_property(sprite_property, value)
+
+        start, count = target_ir["blocks"]
+        blocks_data = iter_blocks_data(ir, start, count, block_ids, inputs_by_block, fields_by_block)
+        if block_store is None:
+            sprite.sprite_data["blocks"] = dict(blocks_data)
+        else:
+            sprite.use_block_store(block_store)
+            sprite.sprite_data["blocks"].update_from(blocks_data)
+        yield sprite
+
+
+def project_from_ir(ir: dict, base_path: str | None = None, block_store=None) -> Project:
+    """
+    Builds a Project from the IR in one pass without creating Block or Input objects
+    :param ir: The IR
+    :param base_path: Directory relative asset paths are resolved against, current directory if None
+    :param block_store: SqliteBlockStore blocks are written into instead of dictionaries
+    :return: The Project object
+    """
+    project = Project()
+    for sprite in iter_ir_targets(ir, base_path=base_path, block_store=block_store):
+        project.add_sprite(sprite)
+    return project
+
+
+def write_project_json_from_ir(ir: dict, file, base_path: str | None = None) -> [Costume]:
+    """
+    Writes project.json straight from the IR, each target is released as soon as it's written
+    :param ir: The IR
+    :param file: File object opened for writing text
+    :param base_path: Directory relative asset paths are resolved against, current directory if None
+    :return: Costumes used in the project, to be saved next to project.json
+    """
+    project_data = Project().project_data
+    costumes = {}
+
+    file.write('{"targets": [')
+    for target_index, sprite in enumerate(iter_ir_targets(ir, base_path=base_path)):
+        if target_index > 0:
+            file.write(", ")
+        dump_project_data(sprite.sprite_data, file)
+        for costume in sprite.costume_objects:
+            costumes[costume.costume_data["md5ext"]] = costume
+    file.write("], ")
+    file.write(json.dumps({key: value for key, value in project_data.items() if key != "targets"})[1:])
+
+    return list(costumes.values())
+
+
+def write_sb3_from_ir(ir: dict, output, base_path: str | None = None):
+    """
+    Writes the .sb3 archive straight from the IR without building a Project
+    :param ir: The IR
+    :param output: Path of the .sb3 file or a binary file object
+    :param base_path: Directory relative asset paths are resolved against, current directory if None
+    """
+    with zipfile.ZipFile(output, "w") as zip_file:
+        with zip_file.open("project.json", "w") as project_file:
+            with io.TextIOWrapper(project_file, encoding="utf-8") as text_file:
+                costumes = write_project_json_from_ir(ir, text_file, base_path=base_path)
+
+        for costume in costumes:
+            costume.write_to_archive(zip_file)
+
+
+def ir_digest(ir: dict) -> str:
+    """
+    Generates a stable hash of the IR, usable as a cache key for build artifacts
+    :param ir: The IR
+    :return: sha256 hash as a string
+    """
+    return sha256(json.dumps(ir, separators=(",", ":"), sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def save_ir(ir: dict, file_path: str):
+    """
+    Saves the IR as compact json, gzipped if the path ends with .gz
+    :param ir: The IR
+    :param file_path: Path of the IR file
+    """
+    open_file = gzip.open if file_path.endswith(".gz") else open
+    with open_file(file_path, "wt", encoding="utf-8") as ir_file:
+        json.dump(ir, ir_file, separators=(",", ":"))
+
+
+def load_ir(file_path: str) -> dict:
+    """
+    Loads and validates an IR file saved with save_ir
+    :param file_path: Path of the IR file
+    :return: The IR
+    """
+    open_file = gzip.open if file_path.endswith(".gz") else open
+    with open_file(file_path, "rt", encoding="utf-8") as ir_file:
+        ir = json.load(ir_file)
+    validate_ir(ir)
+    return ir
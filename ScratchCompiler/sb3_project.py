@@ -1,7 +1,19 @@
+from .blocks import BROADCAST_PRIMITIVE, LiteralType
+from .exceptions import ScratchCompilerException
 from .target import *
 from .zipper import zip_files
+import asyncio
+import io
 import json
 import os
+import tempfile
+import zipfile
+from concurrent.futures import Executor
+from uuid import uuid4
+
+# LiteralType values of variable, list and broadcast references inside inputs
+SYMBOL_PRIMITIVES = (LiteralType.VARIABLE_REFERENCE, LiteralType.LIST_REFERENCE, BROADCAST_PRIMITIVE)
+SYMBOL_FIELDS = ("VARIABLE", "LIST", "BROADCAST_OPTION")
 
 SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 BUILD_FOLDER_PATH = os.path.join(SCRIPT_PATH, "build")
@@ -18,6 +30,154 @@ def ensure_folders_exist(*folder_paths: str):
         os.makedirs(folder_path, exist_ok=True)
 
 
+def iter_project_json(project_data: dict):
+    """
+    Encodes the project data the same way json.dump does, but streams StreamedValue contents
+    like ListData chunk by chunk instead of copying them into python lists first
+    :param project_data: Project data dictionary
+    :return: Generator of json string chunks
+    """
+    placeholder_prefix = f"StreamedValue-{uuid4().hex}-"
+    placeholders = {}
+
+    def default(value):
+        if isinstance(value, StreamedValue):
+            placeholder = f"{placeholder_prefix}{len(placeholders)}"
+            placeholders[json.dumps(placeholder)] = value
+            return placeholder
+        return json_default(value)
+
+    for chunk in json.JSONEncoder(default=default).iterencode(project_data):
+        streamed_value = placeholders.get(chunk)
+        if streamed_value is None:
+            yield chunk
+            continue
+        yield from streamed_value.iter_json()
+
+
+def serialize_target(target_data: dict) -> str:
+    """
+    Encodes a single target into json, used by worker processes of parallel serialization.
+    Unlike iter_project_json this builds the whole string at once with the faster C encoder,
+    the output is the same
+    :param target_data: Sprite data dictionary
+    :return: json string
+    """
+    return json.dumps(target_data, default=json_default)
+
+
+def iter_project_json_parallel(project_data: dict, executor: Executor):
+    """
+    Encodes every target in the executor at the same time and splices the results in target order,
+    the output is the same as iter_project_json returns
+    :param project_data: Project data dictionary, "targets" has to be its first key
+    :param executor: Executor encoding the targets, usually a ProcessPoolExecutor
+    :return: Generator of json string chunks
+    """
+    yield '{"targets": ['
+    for target_index, target_json in enumerate(executor.map(serialize_target, project_data["targets"])):
+        if target_index > 0:
+            yield ", "
+        yield target_json
+    yield "]"
+
+    other_data = {key: value for key, value in project_data.items() if key != "targets"}
+    if other_data:
+        yield ", "
+        chunks = iter_project_json(other_data)
+        # skip the opening brace, the rest of the object continues the one opened above
+        yield next(chunks)[1:]
+        yield from chunks
+    else:
+        yield "}"
+
+
+def dump_project_data(project_data: dict, file, executor: Executor | None = None):
+    """
+    Writes the project data as json into a file
+    :param project_data: Project data dictionary
+    :param file: File object opened for writing text
+    :param executor: If set, targets are encoded in parallel by this executor
+    """
+    if executor is not None and next(iter(project_data), None) == "targets":
+        chunks = iter_project_json_parallel(project_data, executor)
+    else:
+        chunks = iter_project_json(project_data)
+
+    for chunk in chunks:
+        file.write(chunk)
+
+
+def remap_block_data(block_data: dict | list, block_map: dict, symbol_map: dict):
+    """
+    Replaces block and symbol IDs referred to by a single block in place
+    :param block_data: Block data like Block.generate_data returns, or a top level variable or list reporter
+    :param block_map: Old block ID -> new block ID
+    :param symbol_map: Old variable, list or broadcast ID -> new ID
+    """
+    if isinstance(block_data, list):
+        if len(block_data) >= 3:
+            block_data[2] = symbol_map.get(block_data[2], block_data[2])
+        return
+
+    for key in ("parent", "next"):
+        if block_data.get(key) is not None:
+            block_data[key] = block_map.get(block_data[key], block_data[key])
+
+    for input_data in block_data.get("inputs", {}).values():
+        for index in range(1, len(input_data)):
+            item = input_data[index]
+            if isinstance(item, str):
+                input_data[index] = block_map.get(item, item)
+            elif isinstance(item, list) and len(item) >= 3 and item[0] in SYMBOL_PRIMITIVES:
+                item[2] = symbol_map.get(item[2], item[2])
+
+    for field_name, field_data in block_data.get("fields", {}).items():
+        if field_name in SYMBOL_FIELDS and len(field_data) >= 2:
+            field_data[1] = symbol_map.get(field_data[1], field_data[1])
+
+
+def remap_blocks(blocks, block_map: dict, symbol_map: dict):
+    """
+    Replaces block and symbol IDs of blocks one at a time
+    :param blocks: Iterable of (block id, block data) tuples
+    :param block_map: Old block ID -> new block ID
+    :param symbol_map: Old variable, list or broadcast ID -> new ID
+    :return: Generator of (new block id, block data) tuples
+    """
+    for block_id, block_data in blocks:
+        remap_block_data(block_data, block_map, symbol_map)
+        yield block_map.get(block_id, block_id), block_data
+
+
+def remap_sprite_ids(sprite_data: dict, block_map: dict, symbol_map: dict):
+    """
+    Replaces block and symbol IDs in the declarations, blocks and comments of a sprite
+    :param sprite_data: Sprite data dictionary
+    :param block_map: Old block ID -> new block ID
+    :param symbol_map: Old variable, list or broadcast ID -> new ID
+    """
+    for section in ("variables", "lists", "broadcasts"):
+        declarations = sprite_data[section]
+        if any(symbol_id in symbol_map for symbol_id in declarations):
+            sprite_data[section] = {symbol_map.get(symbol_id, symbol_id): declaration
+                                    for symbol_id, declaration in declarations.items()}
+
+    old_blocks = sprite_data["blocks"]
+    if isinstance(old_blocks, dict):
+        sprite_data["blocks"] = dict(remap_blocks(old_blocks.items(), block_map, symbol_map))
+    else:
+        # remapped blocks are streamed into a new target of the store, the old one is dropped at once afterwards
+        blocks = old_blocks.store.target_blocks()
+        blocks.update_from(remap_blocks(old_blocks.items(), block_map, symbol_map))
+        old_blocks.clear()
+        sprite_data["blocks"] = blocks
+
+    for comment_data in sprite_data["comments"].values():
+        if comment_data.get("blockId") is not None:
+            comment_data["blockId"] = block_map.get(comment_data["blockId"], comment_data["blockId"])
+
+
 class Project:
     """
         Abstraction of the project.json file from .sb3 format
@@ -43,28 +203,249 @@ class Project:
         self.sprite_objects.append(sprite)
         self.project_data["targets"].append(sprite.sprite_data)
 
-    def build_project_data(self, temp_dir_path: str):
+    def iter_assets(self):
+        """
+        Goes through every asset used in the project, each asset is returned once even if used by multiple targets
+        :return: Generator of (md5ext, Costume or Sound) tuples
+        """
+        seen = set()
+        for sprite in self.sprite_objects:
+            for md5ext, asset in sprite.iter_assets():
+                if md5ext in seen:
+                    continue
+                seen.add(md5ext)
+                yield md5ext, asset
+
+    def import_sprite3(self, source) -> Sprite:
+        """
+        Adds a sprite from a .sprite3 file, its blocks are spliced in as they are,
+        see splice_sprite
+        :param source: Path of the .sprite3 file or a binary file object
+        :return: The imported sprite
+        """
+        sprite = read_sprite3(source)
+        self.splice_sprite(sprite)
+        return sprite
+
+    def splice_sprite(self, sprite: Sprite):
+        """
+        Adds an already built sprite without rebuilding its blocks. Block, variable, list and broadcast IDs
+        are only replaced when another target of the project already uses them, broadcasts with a name
+        that already exists are merged into the existing broadcast. The sprite gets a new name if its name is taken
+        :param sprite: Sprite object, like one from read_sprite3
+        """
+        block_ids = set()
+        symbol_ids = set()
+        broadcast_ids = {}
+        names = set()
+        layer_order = 0
+        for target in self.sprite_objects:
+            target_data = target.sprite_data
+            block_ids.update(target_data["blocks"])
+            symbol_ids.update(target_data["variables"])
+            symbol_ids.update(target_data["lists"])
+            symbol_ids.update(target_data["broadcasts"])
+            for broadcast_id, broadcast_name in target_data["broadcasts"].items():
+                broadcast_ids.setdefault(broadcast_name, broadcast_id)
+            names.add(target_data["name"])
+            layer_order = max(layer_order, target_data.get("layerOrder", 0))
+
+        sprite_data = sprite.sprite_data
+        block_map = {block_id: str(uuid4()) for block_id in sprite_data["blocks"] if block_id in block_ids}
+        symbol_map = {}
+        for section in ("variables", "lists"):
+            for symbol_id in sprite_data[section]:
+                if symbol_id in symbol_ids:
+                    symbol_map[symbol_id] = str(uuid4())
+        for broadcast_id, broadcast_name in sprite_data["broadcasts"].items():
+            existing_id = broadcast_ids.get(broadcast_name)
+            if existing_id is not None:
+                if existing_id != broadcast_id:
+                    symbol_map[broadcast_id] = existing_id
+            elif broadcast_id in symbol_ids:
+                symbol_map[broadcast_id] = str(uuid4())
+
+        if block_map or symbol_map:
+            remap_sprite_ids(sprite_data, block_map, symbol_map)
+
+        name = base_name = sprite_data["name"]
+        number = 2
+        while name in names:
+            name = f"{base_name}{number}"
+            number += 1
+        sprite_data["name"] = name
+        sprite_data["layerOrder"] = layer_order + 1
+
+        self.add_sprite(sprite)
+
+    def build_project_data(self, temp_dir_path: str, executor: Executor | None = None):
         """
         Writes the project.json and all used resources in a temporary folder for zipping
         :param temp_dir_path: Path to a temporary folder
+        :param executor: If set, targets are serialized in parallel by this executor
         """
-        for sprite in self.sprite_objects:
-            for costume in sprite.costume_objects:
-                costume.save_hashed_image(output_dir_path=temp_dir_path)
+        for md5ext, asset in self.iter_assets():
+            asset.source.save(os.path.join(temp_dir_path, md5ext))
 
         with open(os.path.join(temp_dir_path, "project.json"), "w") as project_file:
-            json.dump(self.project_data, project_file)
+            dump_project_data(self.project_data, project_file, executor=executor)
 
 
-def build_sb3_from_project(project: Project, project_name: str = "project", temp_folder_path: str = TEMP_FOLDER_PATH, output_folder_path: str = OUTPUT_FOLDER_PATH):
+def build_sb3_from_project(project: Project, project_name: str = "project", temp_folder_path: str = TEMP_FOLDER_PATH, output_folder_path: str = OUTPUT_FOLDER_PATH, executor: Executor | None = None):
     """
     Creates the .sb3 file from Project object
     :param project: The Project object
     :param project_name: Name of the final file
     :param temp_folder_path: Path to a temporary folder
     :param output_folder_path: Path to a folder where .sb3 file will be saved
+    :param executor: If set, targets are serialized in parallel by this executor
     """
     ensure_folders_exist(temp_folder_path, output_folder_path)
-    project.build_project_data(temp_dir_path=temp_folder_path)
+    project.build_project_data(temp_dir_path=temp_folder_path, executor=executor)
     file_paths = map(lambda basename: os.path.join(temp_folder_path, basename), os.listdir(temp_folder_path))
     zip_files(file_paths=file_paths, output_path=os.path.join(output_folder_path, f"{project_name}.sb3"))
+
+
+def write_sb3(project: Project, output, executor: Executor | None = None):
+    """
+    Writes the .sb3 archive straight from the Project object without using a temporary folder
+    :param project: The Project object
+    :param output: Path of the .sb3 file or a binary file object
+    :param executor: If set, targets are serialized in parallel by this executor
+    """
+    with zipfile.ZipFile(output, "w") as zip_file:
+        for _, asset in project.iter_assets():
+            asset.write_to_archive(zip_file)
+
+        with zip_file.open("project.json", "w") as project_file:
+            with io.TextIOWrapper(project_file, encoding="utf-8") as text_file:
+                dump_project_data(project.project_data, text_file, executor=executor)
+
+
+def write_sprite3(sprite: Sprite, output):
+    """
+    Exports the sprite as a .sprite3 archive with sprite.json and its costumes and sounds,
+    which can be opened by scratch or imported into other projects with Project.import_sprite3
+    :param sprite: The Sprite object, can't be the Stage
+    :param output: Path of the .sprite3 file or a binary file object
+    """
+    if sprite.sprite_data["isStage"]:
+        raise ScratchCompilerException("Stage can't be exported as a sprite!")
+
+    with zipfile.ZipFile(output, "w") as zip_file:
+        seen = set()
+        for md5ext, asset in sprite.iter_assets():
+            if md5ext not in seen:
+                seen.add(md5ext)
+                asset.write_to_archive(zip_file)
+
+        # layer order only has a meaning inside a project
+        sprite_json_data = {key: value for key, value in sprite.sprite_data.items() if key != "layerOrder"}
+        with zip_file.open("sprite.json", "w") as sprite_file:
+            with io.TextIOWrapper(sprite_file, encoding="utf-8") as text_file:
+                dump_project_data(sprite_json_data, text_file)
+
+
+def read_sprite3(source) -> Sprite:
+    """
+    Loads a .sprite3 archive, blocks are kept as the data stored in sprite.json and assets aren't hashed again
+    :param source: Path of the .sprite3 file or a binary file object
+    :return: The Sprite object
+    """
+    with zipfile.ZipFile(source) as zip_file:
+        sprite_data = json.loads(zip_file.read("sprite.json"))
+        if sprite_data.get("isStage", False):
+            raise ScratchCompilerException("Sprite3 file contains the Stage instead of a sprite!")
+
+        sprite = Sprite(name=sprite_data.get("name", "Sprite"))
+        sprite.sprite_data.update(sprite_data)
+
+        asset_contents = {}
+
+        def read_asset(asset_data: dict) -> bytes:
+            md5ext = asset_data.get("md5ext") or f"{asset_data['assetId']}.{asset_data['dataFormat']}"
+            if md5ext not in asset_contents:
+                try:
+                    asset_contents[md5ext] = zip_file.read(md5ext)
+                except KeyError:
+                    raise ScratchCompilerException(f"Sprite3 file is missing the asset {md5ext}!") from None
+            asset_data["md5ext"] = md5ext
+            return asset_contents[md5ext]
+
+        for costume_data in sprite.sprite_data["costumes"]:
+            sprite.costume_objects.append(Costume.from_costume_data(costume_data, read_asset(costume_data)))
+        for sound_data in sprite.sprite_data["sounds"]:
+            sprite.sound_objects.append(Sound.from_sound_data(sound_data, read_asset(sound_data)))
+    return sprite
+
+
+def build_sb3_bytes(project: Project) -> bytes:
+    """
+    Builds the .sb3 file in memory
+    :param project: The Project object
+    :return: Content of the .sb3 file
+    """
+    buffer = io.BytesIO()
+    write_sb3(project, buffer)
+    return buffer.getvalue()
+
+
+def current_umask() -> int:
+    """
+    :return: Umask of the process, read without changing it where possible since builds can run in threads
+    """
+    try:
+        with open("/proc/self/status", "r") as status_file:
+            for line in status_file:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def write_sb3_file(project: Project, output_path: str):
+    """
+    Builds the .sb3 file next to the output path and moves it in place once it's complete,
+    so builds writing to the same path never see each other's partial files
+    :param project: The Project object
+    :param output_path: Path of the .sb3 file
+    """
+    output_dir_path = os.path.dirname(os.path.abspath(output_path))
+    ensure_folders_exist(output_dir_path)
+
+    file_descriptor, partial_path = tempfile.mkstemp(suffix=".sb3.partial", dir=output_dir_path)
+    try:
+        with os.fdopen(file_descriptor, "wb") as partial_file:
+            write_sb3(project, partial_file)
+        # mkstemp creates the file readable only by the owner, the output gets the usual mode of new files
+        os.chmod(partial_path, 0o666 & ~current_umask())
+        os.replace(partial_path, output_path)
+    except BaseException:
+        os.remove(partial_path)
+        raise
+
+
+async def build_sb3_async(project: Project, output_path: str | None = None, executor: Executor | None = None,
+                          limiter: asyncio.Semaphore | None = None) -> bytes | None:
+    """
+    Builds the .sb3 file without blocking the event loop, every build is isolated so any amount
+    of them can run at the same time
+    :param project: The Project object, it must not be changed until the build is finished
+    :param output_path: Path where the .sb3 file will be saved, if None the content is returned instead
+    :param executor: Executor running the build, the default executor of the loop is used if None.
+    ProcessPoolExecutor can be used as long as the project is picklable
+    :param limiter: Semaphore shared between builds to limit how many of them run at once
+    :return: Content of the .sb3 file or None if it was saved to output_path
+    """
+    loop = asyncio.get_running_loop()
+
+    if limiter is None:
+        if output_path is None:
+            return await loop.run_in_executor(executor, build_sb3_bytes, project)
+        return await loop.run_in_executor(executor, write_sb3_file, project, output_path)
+
+    async with limiter:
+        return await build_sb3_async(project, output_path=output_path, executor=executor)
@@ -0,0 +1,338 @@
+import argparse
+import importlib
+import io
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .exceptions import RequestRejectedException, ScratchCompilerException
+from .ir import write_sb3_from_ir
+from .sb3_project import Project, build_sb3_bytes
+from .target import ASSET_HASH_CACHE
+
+SB3_CONTENT_TYPE = "application/x.scratch.sb3"
+LATENCY_WINDOW = 1000
+
+module_modification_times = {}
+
+
+def load_factory(factory: str, allowed_modules=None):
+    """
+    Imports the project factory, the module is reloaded when its source file changed since the last import
+    :param factory: Factory in the 'module:function' format
+    :param allowed_modules: Names of modules factories can come from, any module if None
+    :return: The factory function
+    """
+    module_name, separator, function_name = factory.partition(":")
+    if not separator or not module_name or not function_name:
+        raise RequestRejectedException(f"Factory '{factory}' has to be in the 'module:function' format!", 400)
+    if allowed_modules is not None and module_name not in allowed_modules:
+        raise RequestRejectedException(f"Module '{module_name}' isn't allowed, start the service with --allow-module!")
+    if function_name.startswith("_"):
+        raise RequestRejectedException(f"Factory '{factory}' is private!")
+
+    module = importlib.import_module(module_name)
+    module_path = getattr(module, "__file__", None)
+    if module_path is not None:
+        modification_time = os.stat(module_path).st_mtime_ns
+        if module_modification_times.setdefault(module_name, modification_time) != modification_time:
+            module = importlib.reload(module)
+            module_modification_times[module_name] = modification_time
+
+    function = getattr(module, function_name, None)
+    if not callable(function):
+        raise RequestRejectedException(f"Factory '{factory}' isn't a function!", 400)
+    return function
+
+
+def resolve_asset_base_path(ir: dict, base_path, asset_root: str) -> str:
+    """
+    Checks that every asset of the IR lies inside the asset root, so requests can't read other files
+    :param ir: The IR
+    :param base_path: Base path from the request, relative to the asset root, the asset root if None
+    :param asset_root: Directory assets have to be inside of
+    :return: Absolute base path for loading the IR
+    """
+    asset_root = os.path.realpath(asset_root)
+    if base_path is not None and not isinstance(base_path, str):
+        raise RequestRejectedException("Request 'basePath' has to be a string!", 400)
+    base_path = os.path.realpath(os.path.join(asset_root, base_path or ""))
+
+    assets = ir.get("assets") if isinstance(ir, dict) else None
+    for asset in [base_path] + [os.path.realpath(os.path.join(base_path, str(row[1])))
+                                for row in (assets if isinstance(assets, list) else ())]:
+        if os.path.commonpath([asset_root, asset]) != asset_root:
+            raise RequestRejectedException(f"Asset path '{asset}' is outside of the asset root!")
+    return base_path
+
+
+def build_from_request(request: dict, allowed_modules=None, asset_root: str | None = None) -> (bytes, int, int):
+    """
+    Builds an .sb3 file described by a request, runs inside a worker process
+    :param request: Dictionary with 'factory' and optional 'args' and 'kwargs',
+    or with 'ir' and optional 'basePath' for resolving relative asset paths
+    :param allowed_modules: Names of modules factories can come from, any module if None
+    :param asset_root: Directory IR assets have to be inside of, assets aren't checked if None
+    :return: Content of the .sb3 file, asset hash cache hits and misses during the build
+    """
+    hits, misses = ASSET_HASH_CACHE.hits, ASSET_HASH_CACHE.misses
+
+    if "ir" in request:
+        base_path = request.get("basePath")
+        if asset_root is not None:
+            base_path = resolve_asset_base_path(request["ir"], base_path, asset_root)
+        buffer = io.BytesIO()
+        write_sb3_from_ir(request["ir"], buffer, base_path=base_path)
+        return buffer.getvalue(), ASSET_HASH_CACHE.hits - hits, ASSET_HASH_CACHE.misses - misses
+
+    factory = request.get("factory")
+    if not isinstance(factory, str):
+        raise RequestRejectedException("Request has to contain 'factory' string or 'ir' object!", 400)
+
+    project = load_factory(factory, allowed_modules)(*request.get("args", []), **request.get("kwargs", {}))
+    if not isinstance(project, Project):
+        raise ScratchCompilerException(f"Factory '{factory}' returned {type(project)} instead of a Project!")
+
+    sb3_bytes = build_sb3_bytes(project)
+    return sb3_bytes, ASSET_HASH_CACHE.hits - hits, ASSET_HASH_CACHE.misses - misses
+
+
+def warm_up_worker(preload_modules: [str]):
+    """
+    Imports modules ahead of the first request, so workers don't pay for it later
+    :param preload_modules: Names of modules to import
+    """
+    for module_name in preload_modules:
+        importlib.import_module(module_name)
+
+
+class ServiceMetrics:
+    """
+        Thread safe counters of the compile service
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.latencies = []
+
+    def record(self, latency: float, failed: bool, cache_hits: int = 0, cache_misses: int = 0):
+        """
+        :param latency: Time in seconds the request took
+        :param failed: Defines if the request failed
+        :param cache_hits: Asset hash cache hits during the request
+        :param cache_misses: Asset hash cache misses during the request
+        """
+        with self.lock:
+            self.requests += 1
+            self.errors += int(failed)
+            self.cache_hits += cache_hits
+            self.cache_misses += cache_misses
+            self.latencies.append(latency)
+            if len(self.latencies) > LATENCY_WINDOW:
+                del self.latencies[:len(self.latencies) - LATENCY_WINDOW]
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            latencies = sorted(self.latencies)
+
+            def percentile(fraction: float) -> float | None:
+                if not latencies:
+                    return None
+                return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+
+            cache_lookups = self.cache_hits + self.cache_misses
+            return {
+                "uptimeSeconds": time.time() - self.started_at,
+                "requests": self.requests,
+                "errors": self.errors,
+                "latencyMs": {
+                    "p50": percentile(0.5),
+                    "p95": percentile(0.95),
+                    "max": latencies[-1] * 1000 if latencies else None
+                },
+                "assetHashCache": {
+                    "hits": self.cache_hits,
+                    "misses": self.cache_misses,
+                    "hitRate": self.cache_hits / cache_lookups if cache_lookups else None
+                }
+            }
+
+
+class CompileRequestHandler(BaseHTTPRequestHandler):
+    """
+        Handles the HTTP requests of the compile service
+        POST /build with json body {"factory": "module:function", "args": [], "kwargs": {}}
+        or {"ir": {...}, "basePath": "..."} returns the .sb3 file
+        GET /metrics returns the service metrics as json
+        Requests from browsers, which send an Origin header, and bodies that aren't application/json are rejected,
+        so web pages can't use the service
+    """
+    server: "CompileServer"
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.send_body(200, json.dumps(self.server.metrics.to_dict()).encode("utf-8"), "application/json")
+            return
+        if self.path == "/health":
+            self.send_body(200, b"ok", "text/plain")
+            return
+        self.send_error_message(404, f"Unknown path {self.path}")
+
+    def do_POST(self):
+        if self.path != "/build":
+            self.send_error_message(404, f"Unknown path {self.path}")
+            return
+
+        start_time = time.perf_counter()
+        if self.headers.get("Origin") is not None:
+            self.server.metrics.record(time.perf_counter() - start_time, failed=True)
+            self.send_error_message(403, "Cross origin requests aren't allowed")
+            return
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            self.server.metrics.record(time.perf_counter() - start_time, failed=True)
+            self.send_error_message(415, "Content-Type has to be application/json")
+            return
+
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            request = json.loads(body)
+            if not isinstance(request, dict):
+                raise ScratchCompilerException("Request body has to be a json object!")
+        except (ValueError, ScratchCompilerException) as exception:
+            self.server.metrics.record(time.perf_counter() - start_time, failed=True)
+            self.send_error_message(400, str(exception))
+            return
+
+        try:
+            sb3_bytes, cache_hits, cache_misses = self.server.executor.submit(
+                build_from_request, request, self.server.allowed_modules, self.server.asset_root).result()
+        except RequestRejectedException as exception:
+            self.server.metrics.record(time.perf_counter() - start_time, failed=True)
+            self.send_error_message(exception.status, str(exception))
+            return
+        except Exception as exception:
+            self.server.metrics.record(time.perf_counter() - start_time, failed=True)
+            self.send_error_message(500, f"{type(exception).__name__}: {exception}")
+            return
+
+        self.server.metrics.record(time.perf_counter() - start_time, failed=False,
+                                   cache_hits=cache_hits, cache_misses=cache_misses)
+        self.send_body(200, sb3_bytes, SB3_CONTENT_TYPE)
+
+    def send_body(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_message(self, status: int, message: str):
+        self.send_body(status, json.dumps({"error": message}).encode("utf-8"), "application/json")
+
+    def address_string(self) -> str:
+        # unix sockets don't have a client address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def is_unix_socket(path: str) -> bool:
+    """
+    :param path: Path in the file system
+    :return: Defines if the path is a unix socket, symbolic links aren't followed
+    """
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+class CompileServer(ThreadingHTTPServer):
+    """
+        HTTP server that keeps a pool of warm worker processes for building projects
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, workers: int | None = None, preload_modules: [str] = (),
+                 verbose: bool = False, allowed_modules: [str] = (), asset_root: str = "."):
+        """
+        :param server_address: (host, port) tuple or path of a unix socket
+        :param workers: Amount of worker processes, amount of cpus if None
+        :param preload_modules: Modules imported by every worker on start, factories can come from them
+        :param verbose: Defines if requests are logged
+        :param allowed_modules: Other modules factories can come from
+        :param asset_root: Directory assets of IR requests have to be inside of
+        """
+        self.allowed_modules = frozenset(preload_modules) | frozenset(allowed_modules)
+        self.asset_root = os.path.realpath(asset_root)
+        if isinstance(server_address, str):
+            self.address_family = socket.AF_UNIX
+            # a socket left behind by a previous run is replaced, anything else at the path is kept
+            if is_unix_socket(server_address):
+                os.remove(server_address)
+            elif os.path.lexists(server_address):
+                raise ScratchCompilerException(f"Can't listen on {server_address}, it exists and isn't a unix socket!")
+
+        self.metrics = ServiceMetrics()
+        self.verbose = verbose
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=warm_up_worker,
+                                            initargs=(list(preload_modules),))
+        super().__init__(server_address, CompileRequestHandler)
+
+    def server_bind(self):
+        if self.address_family != socket.AF_UNIX:
+            super().server_bind()
+            return
+        # HTTPServer.server_bind expects a (host, port) address
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(cancel_futures=True)
+        if self.address_family == socket.AF_UNIX and is_unix_socket(self.server_address):
+            os.remove(self.server_address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local service building .sb3 files with warm caches")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--unix-socket", help="Listen on a unix socket at this path instead of host and port")
+    parser.add_argument("--workers", type=int, default=None, help="Amount of worker processes")
+    parser.add_argument("--preload", action="append", default=[],
+                        help="Module every worker imports on start, factories can come from it")
+    parser.add_argument("--allow-module", action="append", default=[],
+                        help="Module factories can come from without preloading it")
+    parser.add_argument("--asset-root", default=".", help="Directory assets of IR requests have to be inside of")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    server_address = args.unix_socket if args.unix_socket else (args.host, args.port)
+
+    with CompileServer(server_address, workers=args.workers, preload_modules=args.preload,
+                       verbose=args.verbose, allowed_modules=args.allow_module,
+                       asset_root=args.asset_root) as server:
+        print(f"Compile service listening on {args.unix_socket or f'http://{args.host}:{args.port}'}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from hashlib import md5
+
+from .exceptions import ScratchCompilerException
+from .image_info import PNG_SIGNATURE
+from .target import AssetSource, Costume, Sprite
+
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+GRAYSCALE_COLOR_TYPES = (0, 4)
+PALETTE_COLOR_TYPE = 3
+# chunks describing how colors are interpreted, they are copied into every frame
+COLOR_CHUNKS = (b"cHRM", b"gAMA", b"iCCP", b"sBIT", b"sRGB")
+
+
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def add_rows(row: bytes, prior: bytes, low_mask: int, high_mask: int) -> bytes:
+    """
+    Adds two rows byte by byte modulo 256 using whole rows as integers, which is what the "up" filter needs
+    """
+    x = int.from_bytes(row, "big")
+    y = int.from_bytes(prior, "big")
+    return (((x & low_mask) + (y & low_mask)) ^ ((x ^ y) & high_mask)).to_bytes(len(row), "big")
+
+
+def unfilter_rows(data: bytes, height: int, row_size: int, stride: int) -> [bytes]:
+    """
+    Reverses the png filters of every row
+    :param data: Decompressed image data, each row starts with its filter type
+    :param height: Amount of rows
+    :param row_size: Amount of bytes in a row without the filter type
+    :param stride: Amount of bytes in a pixel, at least 1
+    :return: List of rows
+    """
+    if len(data) < height * (row_size + 1):
+        raise ScratchCompilerException("Png image data is truncated!")
+
+    low_mask = int.from_bytes(b"\x7f" * row_size, "big")
+    high_mask = int.from_bytes(b"\x80" * row_size, "big")
+    rows = []
+    prior = bytes(row_size)
+    position = 0
+    for _ in range(height):
+        filter_type = data[position]
+        raw = data[position + 1:position + 1 + row_size]
+        position += row_size + 1
+
+        if filter_type == 0:
+            row = raw
+        elif filter_type == 2:
+            row = add_rows(raw, prior, low_mask, high_mask)
+        elif filter_type == 1:
+            row = bytearray(raw)
+            for i in range(stride, row_size):
+                row[i] = (row[i] + row[i - stride]) & 0xff
+            row = bytes(row)
+        elif filter_type == 3:
+            row = bytearray(raw)
+            for i in range(stride):
+                row[i] = (row[i] + (prior[i] >> 1)) & 0xff
+            for i in range(stride, row_size):
+                row[i] = (row[i] + ((row[i - stride] + prior[i]) >> 1)) & 0xff
+            row = bytes(row)
+        elif filter_type == 4:
+            row = bytearray(raw)
+            for i in range(stride):
+                row[i] = (row[i] + prior[i]) & 0xff
+            for i in range(stride, row_size):
+                left = row[i - stride]
+                up = prior[i]
+                up_left = prior[i - stride]
+                estimate = left + up - up_left
+                left_distance = abs(estimate - left)
+                up_distance = abs(estimate - up)
+                up_left_distance = abs(estimate - up_left)
+                if left_distance <= up_distance and left_distance <= up_left_distance:
+                    predictor = left
+                elif up_distance <= up_left_distance:
+                    predictor = up
+                else:
+                    predictor = up_left
+                row[i] = (row[i] + predictor) & 0xff
+            row = bytes(row)
+        else:
+            raise ScratchCompilerException(f"Png image uses unknown filter type {filter_type}!")
+
+        rows.append(row)
+        prior = row
+    return rows
+
+
+class PngImage:
+    """
+        Decoded png image, rows are kept unfiltered with the original color type.
+        Images with less than 8 bits per sample are widened to 8 bits, so every pixel starts at a whole byte
+    """
+    def __init__(self, width: int, height: int, bit_depth: int, color_type: int, rows: [bytes],
+                 chunks: [(bytes, bytes)]):
+        """
+        :param width: Width in pixels
+        :param height: Height in pixels
+        :param bit_depth: Bits per sample, 8 or 16
+        :param color_type: Png color type
+        :param rows: Unfiltered rows
+        :param chunks: (chunk type, data) of the palette, transparency and color chunks copied into encoded images
+        """
+        self.width = width
+        self.height = height
+        self.bit_depth = bit_depth
+        self.color_type = color_type
+        self.rows = rows
+        self.chunks = chunks
+        self.pixel_size = CHANNELS[color_type] * bit_depth // 8
+
+    @classmethod
+    def decode(cls, data: bytes | memoryview) -> "PngImage":
+        """
+        :param data: Content of a png file, the decoded image doesn't refer to it
+        :return: The decoded image
+        """
+        if data[:len(PNG_SIGNATURE)] != PNG_SIGNATURE:
+            raise ScratchCompilerException("Sprite sheet isn't a png image!")
+
+        header = None
+        chunks = []
+        compressed = []
+        position = len(PNG_SIGNATURE)
+        while position + 8 <= len(data):
+            length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+            chunk_data = data[position + 8:position + 8 + length]
+            position += length + 12
+            if chunk_type == b"IHDR":
+                header = struct.unpack(">IIBBBBB", chunk_data)
+            elif chunk_type == b"IDAT":
+                # copied, views of a mapped file would keep it open while the traceback of an error refers to them
+                compressed.append(bytes(chunk_data))
+            elif chunk_type == b"IEND":
+                break
+            elif chunk_type in (b"PLTE", b"tRNS") or chunk_type in COLOR_CHUNKS:
+                chunks.append((chunk_type, bytes(chunk_data)))
+
+        if header is None or not compressed:
+            raise ScratchCompilerException("Png image has no IHDR or IDAT chunk!")
+        width, height, bit_depth, color_type, _, _, interlace = header
+        if color_type not in CHANNELS:
+            raise ScratchCompilerException(f"Png image uses unknown color type {color_type}!")
+        if interlace != 0:
+            raise ScratchCompilerException("Interlaced png sprite sheets aren't supported!")
+
+        bits_per_pixel = CHANNELS[color_type] * bit_depth
+        try:
+            decompressed = zlib.decompress(b"".join(compressed))
+        except zlib.error as exception:
+            raise ScratchCompilerException(f"Png image data is corrupt: {exception}") from None
+        rows = unfilter_rows(decompressed, height, (width * bits_per_pixel + 7) // 8, max(1, bits_per_pixel // 8))
+
+        if bit_depth < 8:
+            rows, chunks = cls.widen(rows, width, bit_depth, color_type, chunks)
+            bit_depth = 8
+        return cls(width, height, bit_depth, color_type, rows, chunks)
+
+    @staticmethod
+    def widen(rows: [bytes], width: int, bit_depth: int, color_type: int, chunks: [(bytes, bytes)]):
+        """
+        Turns rows with 1, 2 or 4 bits per pixel into rows with a byte per pixel,
+        grayscale values and the transparent gray value are scaled to the 8 bit range
+        :return: (rows, chunks)
+        """
+        max_value = (1 << bit_depth) - 1
+        shifts = range(8 - bit_depth, -1, -bit_depth)
+        scale = 1 if color_type == PALETTE_COLOR_TYPE else 255 // max_value
+        # maps every packed byte to the widened bytes of the pixels inside it
+        table = [bytes(((byte >> shift) & max_value) * scale for shift in shifts) for byte in range(256)]
+        rows = [b"".join(table[byte] for byte in row)[:width] for row in rows]
+
+        if color_type in GRAYSCALE_COLOR_TYPES:
+            chunks = [(chunk_type, struct.pack(">H", struct.unpack(">H", chunk_data)[0] * scale)
+                       if chunk_type == b"tRNS" else chunk_data)
+                      for chunk_type, chunk_data in chunks if chunk_type != b"sBIT"]
+        return rows, chunks
+
+    def crop_rows(self, x: int, y: int, width: int, height: int) -> [bytes]:
+        """
+        :return: Rows of the rectangle
+        """
+        if x < 0 or y < 0 or width <= 0 or height <= 0 or x + width > self.width or y + height > self.height:
+            raise ScratchCompilerException(
+                f"Frame {width}x{height} at ({x}, {y}) is outside of the {self.width}x{self.height} sprite sheet!")
+        start = x * self.pixel_size
+        end = (x + width) * self.pixel_size
+        return [row[start:end] for row in self.rows[y:y + height]]
+
+    def encode(self, rows: [bytes], width: int, compression_level: int = 6) -> bytes:
+        """
+        Encodes rows cropped from this image into a png file with the same color type and palette
+        :param rows: The rows
+        :param width: Width of the rows in pixels
+        :param compression_level: zlib compression level
+        :return: Content of the png file
+        """
+        header = struct.pack(">IIBBBBB", width, len(rows), self.bit_depth, self.color_type, 0, 0, 0)
+        image_data = zlib.compress(b"".join(b"\x00" + row for row in rows), compression_level)
+        return b"".join([PNG_SIGNATURE, png_chunk(b"IHDR", header)]
+                        + [png_chunk(chunk_type, chunk_data) for chunk_type, chunk_data in self.chunks]
+                        + [png_chunk(b"IDAT", image_data), png_chunk(b"IEND", b"")])
+
+
+class SpriteFrame:
+    """
+        Rectangle of a sprite sheet turned into a single costume
+    """
+    def __init__(self, name: str, x: int, y: int, width: int, height: int, px_pivot: tuple | None = None):
+        """
+        :param name: Name of the costume
+        :param x: Left edge in the sheet
+        :param y: Top edge in the sheet
+        :param width: Width in pixels
+        :param height: Height in pixels
+        :param px_pivot: Rotation center relative to the top left corner of the frame, the center of the frame if None
+        """
+        self.name = name
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.px_pivot = px_pivot
+
+    def __repr__(self):
+        return f"SpriteFrame({self.name!r}, {self.width}x{self.height} at ({self.x}, {self.y}))"
+
+
+def grid_frames(sheet_width: int, sheet_height: int, frame_width: int, frame_height: int, count: int | None = None,
+                margin: int = 0, spacing: int = 0, name: str = "frame") -> [SpriteFrame]:
+    """
+    Splits a sheet into frames of the same size, row by row from the top left corner
+    :param sheet_width: Width of the sheet
+    :param sheet_height: Height of the sheet
+    :param frame_width: Width of a frame
+    :param frame_height: Height of a frame
+    :param count: Amount of frames, every cell of the grid if None
+    :param margin: Pixels around the grid
+    :param spacing: Pixels between frames
+    :param name: Frames are named by this and their number starting at 1
+    :return: List of frames
+    """
+    columns = (sheet_width - 2 * margin + spacing) // (frame_width + spacing)
+    rows = (sheet_height - 2 * margin + spacing) // (frame_height + spacing)
+    if columns < 1 or rows < 1:
+        raise ScratchCompilerException(
+            f"Frame size {frame_width}x{frame_height} doesn't fit into the {sheet_width}x{sheet_height} sprite sheet!")
+    if count is None:
+        count = columns * rows
+    elif count > columns * rows:
+        raise ScratchCompilerException(f"Sprite sheet has only {columns * rows} frames, {count} were requested!")
+
+    return [SpriteFrame(f"{name}{index + 1}",
+                        margin + (index % columns) * (frame_width + spacing),
+                        margin + (index // columns) * (frame_height + spacing),
+                        frame_width, frame_height)
+            for index in range(count)]
+
+
+def manifest_frames(manifest: dict | str) -> [SpriteFrame]:
+    """
+    Reads frames from a manifest in the json format exported by TexturePacker and Aseprite,
+    "frames" can be both an object keyed by frame names or an array of frames with "filename".
+    Trimmed frames get their rotation center moved so they stay aligned with the untrimmed frames
+    :param manifest: The manifest or path to its json file
+    :return: List of frames in manifest order
+    """
+    if isinstance(manifest, str):
+        with open(manifest, "r", encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+
+    frames_data = manifest.get("frames")
+    if isinstance(frames_data, dict):
+        frames_data = [dict(frame_data, filename=name) for name, frame_data in frames_data.items()]
+    if not isinstance(frames_data, list):
+        raise ScratchCompilerException("Sprite sheet manifest has no frames!")
+
+    frames = []
+    for frame_data in frames_data:
+        name = os.path.splitext(frame_data["filename"])[0]
+        if frame_data.get("rotated", False):
+            raise ScratchCompilerException(f"Frame '{name}' is rotated inside the sprite sheet, which isn't supported!")
+
+        rectangle = frame_data["frame"]
+        source_size = frame_data.get("sourceSize", {"w": rectangle["w"], "h": rectangle["h"]})
+        source_offset = frame_data.get("spriteSourceSize", {"x": 0, "y": 0})
+        pivot = frame_data.get("pivot", {"x": 0.5, "y": 0.5})
+
+        px_pivot = None
+        if frame_data.get("trimmed", False) or "pivot" in frame_data:
+            px_pivot = (source_size["w"] * pivot["x"] - source_offset["x"],
+                        source_size["h"] * pivot["y"] - source_offset["y"])
+        frames.append(SpriteFrame(name, rectangle["x"], rectangle["y"], rectangle["w"], rectangle["h"], px_pivot))
+    return frames
+
+
+class SpriteSheet:
+    """
+        Png sprite sheet sliced into costumes in memory.
+        Frames with the same pixels share one encoded image, so they become a single asset inside the .sb3 file
+    """
+    def __init__(self, source: str | bytes | memoryview | mmap.mmap, compression_level: int = 6):
+        """
+        :param source: Path to the png sheet or its content
+        :param compression_level: zlib compression level of encoded frames
+        """
+        with AssetSource(source).open_buffer() as buffer:
+            self.image = PngImage.decode(buffer)
+        self.compression_level = compression_level
+        # hash of the frame pixels -> costume holding the encoded frame
+        self.frame_costumes = {}
+        self.frame_count = 0
+
+    @property
+    def unique_count(self) -> int:
+        return len(self.frame_costumes)
+
+    def grid(self, frame_width: int, frame_height: int, count: int | None = None, margin: int = 0, spacing: int = 0,
+             name: str = "frame") -> [SpriteFrame]:
+        """
+        Same as grid_frames using the size of this sheet
+        """
+        return grid_frames(self.image.width, self.image.height, frame_width, frame_height, count=count,
+                           margin=margin, spacing=spacing, name=name)
+
+    def slice_frame(self, frame: SpriteFrame, bitmap_resolution: int = 1) -> Costume:
+        """
+        :param frame: The frame
+        :param bitmap_resolution: The resolution of the frame images
+        :return: Costume of the frame
+        """
+        rows = self.image.crop_rows(frame.x, frame.y, frame.width, frame.height)
+        pixels_hash = md5(struct.pack(">II", frame.width, frame.height))
+        for row in rows:
+            pixels_hash.update(row)
+        key = (pixels_hash.digest(), bitmap_resolution)
+        self.frame_count += 1
+
+        costume = self.frame_costumes.get(key)
+        if costume is None:
+            image_data = self.image.encode(rows, frame.width, self.compression_level)
+            costume = Costume(image_data, "png", frame.name, bitmap_resolution=bitmap_resolution,
+                              px_pivot=frame.px_pivot)
+            self.frame_costumes[key] = costume
+            return costume
+        return costume.copy(name=frame.name, px_pivot=frame.px_pivot or costume.image_info.center)
+
+    def slice(self, frames: [SpriteFrame], bitmap_resolution: int = 1) -> [Costume]:
+        """
+        :param frames: Frames from grid, manifest_frames or any other list of SpriteFrame
+        :param bitmap_resolution: The resolution of the frame images
+        :return: Costume of every frame in the same order
+        """
+        return [self.slice_frame(frame, bitmap_resolution) for frame in frames]
+
+    def add_to_sprite(self, sprite: Sprite, frames: [SpriteFrame], bitmap_resolution: int = 1) -> [Costume]:
+        """
+        Slices the frames and adds them as costumes of the sprite
+        :param sprite: The sprite
+        :param frames: Frames from grid, manifest_frames or any other list of SpriteFrame
+        :param bitmap_resolution: The resolution of the frame images
+        :return: The added costumes
+        """
+        costumes = self.slice(frames, bitmap_resolution)
+        for costume in costumes:
+            sprite.add_costume(costume)
+        return costumes
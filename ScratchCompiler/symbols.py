@@ -0,0 +1,309 @@
+from enum import StrEnum
+
+from .blocks import BROADCAST_PRIMITIVE, Block, InputType, LiteralType, Reference
+from .exceptions import ScratchCompilerException
+from .sb3_project import Project
+from .target import ListData, Sprite
+
+
+class SymbolKind(StrEnum):
+    """
+        Enum class for every kind of named value a project can declare
+    """
+    VARIABLE = "variable"
+    LIST = "list"
+    BROADCAST = "broadcast"
+
+
+SECTIONS = {
+    SymbolKind.VARIABLE: "variables",
+    SymbolKind.LIST: "lists",
+    SymbolKind.BROADCAST: "broadcasts",
+}
+
+ID_PREFIXES = {
+    SymbolKind.VARIABLE: "v",
+    SymbolKind.LIST: "l",
+    SymbolKind.BROADCAST: "m",
+}
+
+PRIMITIVES = {
+    LiteralType.VARIABLE_REFERENCE: SymbolKind.VARIABLE,
+    LiteralType.LIST_REFERENCE: SymbolKind.LIST,
+    BROADCAST_PRIMITIVE: SymbolKind.BROADCAST,
+}
+
+FIELDS = {
+    "VARIABLE": SymbolKind.VARIABLE,
+    "LIST": SymbolKind.LIST,
+    "BROADCAST_OPTION": SymbolKind.BROADCAST,
+}
+
+
+class Symbol:
+    """
+        Single declared variable, list or broadcast with every place that refers to it
+    """
+    def __init__(self, symbol_id: str, name: str, kind: SymbolKind, owner: Sprite):
+        """
+        :param symbol_id: ID used in project.json
+        :param name: Name shown in scratch
+        :param kind: Kind of the symbol
+        :param owner: Sprite declaring the symbol, the Stage for global symbols
+        """
+        self.symbol_id = symbol_id
+        self.name = name
+        self.kind = kind
+        self.owner = owner
+        # (block id, list holding the name, index of the name in that list)
+        self.references = []
+        self.reference_containers = set()
+
+    @property
+    def is_global(self) -> bool:
+        return self.owner.sprite_data["isStage"]
+
+    @property
+    def referencing_blocks(self) -> [str]:
+        """
+        :return: IDs of blocks referring to the symbol
+        """
+        return list(dict.fromkeys(block_id for block_id, _, _ in self.references))
+
+    def add_reference(self, block_id: str, container: list, name_index: int):
+        if id(container) in self.reference_containers:
+            return
+        self.reference_containers.add(id(container))
+        self.references.append((block_id, container, name_index))
+
+    def __repr__(self):
+        return f"Symbol({self.kind}, {self.name!r}, id={self.symbol_id!r}, owner={self.owner.sprite_data['name']!r})"
+
+
+class SymbolReference(Reference):
+    """
+        Reference to a symbol from a SymbolTable, used for both normal Input and FieldInput.
+        Blocks using it get registered in the symbol, so it can be renamed without searching the blocks
+    """
+    field_compatible = True
+
+    def __init__(self, symbol: Symbol, is_field_selector: bool = False):
+        """
+        :param symbol: The referenced symbol
+        :param is_field_selector: Defines if reference used in a field
+        """
+        self.symbol = symbol
+        self.is_field_selector = is_field_selector
+
+    def generate_reference(self) -> list:
+        symbol = self.symbol
+        if self.is_field_selector:
+            return [symbol.name, symbol.symbol_id]
+        if symbol.kind == SymbolKind.BROADCAST:
+            return [InputType.LITERAL, [BROADCAST_PRIMITIVE, symbol.name, symbol.symbol_id]]
+        primitive = LiteralType.VARIABLE_REFERENCE if symbol.kind == SymbolKind.VARIABLE else LiteralType.LIST_REFERENCE
+        return [InputType.SHADOW_OVERRIDDEN, [primitive, symbol.name, symbol.symbol_id], [LiteralType.NUMBER_LITERAL, 0]]
+
+    def register_use(self, block: Block, reference_data: list) -> None:
+        if self.is_field_selector:
+            self.symbol.add_reference(block.uuid, reference_data, 0)
+        else:
+            self.symbol.add_reference(block.uuid, reference_data[1], 1)
+
+
+class SymbolTable:
+    """
+        Project wide index of variables, lists and broadcasts.
+        Symbols are looked up by name or ID per sprite (local first, then global) in constant time,
+        and they are renamed by updating only the blocks that refer to them.
+        IDs only have to be unique inside their owner like in scratch, new symbols get IDs unused by every sprite.
+    """
+    def __init__(self, project: Project):
+        """
+        Indexes symbols already declared in the project, blocks aren't searched, see scan_references
+        :param project: The Project object
+        """
+        self.project = project
+        # (kind, id of the owner sprite, symbol id) -> Symbol
+        self.by_id = {}
+        # (kind, id of the owner sprite, name) -> Symbol
+        self.by_name = {}
+        self.used_ids = set()
+        self.id_counter = 0
+        self.stage_sprite = None
+
+        for sprite in project.sprite_objects:
+            for kind, section in SECTIONS.items():
+                for symbol_id, declaration in sprite.sprite_data[section].items():
+                    name = declaration if kind == SymbolKind.BROADCAST else declaration[0]
+                    self.add_symbol(Symbol(symbol_id, name, kind, sprite))
+
+    @property
+    def stage(self) -> Sprite:
+        if self.stage_sprite is not None:
+            return self.stage_sprite
+        for sprite in self.project.sprite_objects:
+            if sprite.sprite_data["isStage"]:
+                self.stage_sprite = sprite
+                return sprite
+        raise ScratchCompilerException("Project has no Stage, global symbols can't be declared!")
+
+    def generate_id(self, kind: SymbolKind) -> str:
+        """
+        :param kind: Kind of the symbol
+        :return: Short ID that isn't used by any symbol yet
+        """
+        while True:
+            symbol_id = f"{ID_PREFIXES[kind]}{self.id_counter:x}"
+            self.id_counter += 1
+            if symbol_id not in self.used_ids:
+                return symbol_id
+
+    def add_symbol(self, symbol: Symbol):
+        key = (symbol.kind, id(symbol.owner), symbol.name)
+        if key in self.by_name:
+            raise ScratchCompilerException(
+                f"{symbol.kind.capitalize()} '{symbol.name}' is already declared in '{symbol.owner.sprite_data['name']}'!")
+        id_key = (symbol.kind, id(symbol.owner), symbol.symbol_id)
+        if id_key in self.by_id:
+            raise ScratchCompilerException(
+                f"Symbol ID '{symbol.symbol_id}' is already used in '{symbol.owner.sprite_data['name']}'!")
+        self.by_name[key] = symbol
+        self.by_id[id_key] = symbol
+        self.used_ids.add(symbol.symbol_id)
+
+    def declare(self, kind: SymbolKind, name: str, sprite: Sprite | None = None, value=0) -> Symbol:
+        """
+        Declares a symbol and writes it into the sprite data
+        :param kind: Kind of the symbol
+        :param name: Name shown in scratch
+        :param sprite: Sprite owning the symbol, None or the Stage for global symbols. Broadcasts are always global
+        :param value: Initial value of a variable or initial contents of a list
+        :return: The new symbol
+        """
+        owner = self.stage if sprite is None or kind == SymbolKind.BROADCAST else sprite
+        symbol = Symbol(self.generate_id(kind), name, kind, owner)
+        self.add_symbol(symbol)
+
+        section = owner.sprite_data[SECTIONS[kind]]
+        if kind == SymbolKind.VARIABLE:
+            section[symbol.symbol_id] = [name, value]
+        elif kind == SymbolKind.LIST:
+            section[symbol.symbol_id] = [name, value if isinstance(value, ListData) else ListData(value or ())]
+        else:
+            section[symbol.symbol_id] = name
+        return symbol
+
+    def lookup(self, kind: SymbolKind, name: str, sprite: Sprite | None = None) -> Symbol | None:
+        """
+        Finds the symbol a name refers to inside a sprite, local symbols win over global ones
+        :param kind: Kind of the symbol
+        :param name: Name of the symbol
+        :param sprite: Sprite the name is used in, None for the Stage
+        :return: The symbol or None if the name isn't declared
+        """
+        if sprite is not None:
+            symbol = self.by_name.get((kind, id(sprite), name))
+            if symbol is not None:
+                return symbol
+        return self.by_name.get((kind, id(self.stage), name))
+
+    def resolve(self, kind: SymbolKind, name: str, sprite: Sprite | None = None) -> Symbol:
+        """
+        Same as lookup but raises if the name isn't declared
+        """
+        symbol = self.lookup(kind, name, sprite)
+        if symbol is None:
+            location = f" in '{sprite.sprite_data['name']}'" if sprite is not None else ""
+            raise ScratchCompilerException(f"{kind.capitalize()} '{name}' isn't declared{location}!")
+        return symbol
+
+    def get(self, kind: SymbolKind, symbol_id: str, sprite: Sprite | None = None) -> Symbol | None:
+        """
+        Finds the symbol an ID refers to inside a sprite, local symbols win over global ones
+        :param kind: Kind of the symbol
+        :param symbol_id: ID used in project.json
+        :param sprite: Sprite the ID is used in, None for the Stage
+        :return: The symbol or None if the ID isn't declared
+        """
+        if sprite is not None:
+            symbol = self.by_id.get((kind, id(sprite), symbol_id))
+            if symbol is not None:
+                return symbol
+        return self.by_id.get((kind, id(self.stage), symbol_id))
+
+    def reference(self, kind: SymbolKind, name: str, sprite: Sprite | None = None,
+                  is_field_selector: bool = False) -> SymbolReference:
+        """
+        Creates a reference usable in Input or FieldInput to the symbol the name refers to
+        :param kind: Kind of the symbol
+        :param name: Name of the symbol
+        :param sprite: Sprite the reference is used in, None for the Stage
+        :param is_field_selector: Defines if reference used in a field
+        :return: The reference
+        """
+        return SymbolReference(self.resolve(kind, name, sprite), is_field_selector=is_field_selector)
+
+    def shadowed(self) -> [(Symbol, Symbol)]:
+        """
+        :return: Pairs of (local symbol, global symbol) where a sprite hides a global symbol of the same name
+        """
+        stage_key = id(self.stage)
+        pairs = []
+        for (kind, owner_key, name), symbol in self.by_name.items():
+            if owner_key == stage_key:
+                continue
+            global_symbol = self.by_name.get((kind, stage_key, name))
+            if global_symbol is not None:
+                pairs.append((symbol, global_symbol))
+        return pairs
+
+    def rename(self, symbol: Symbol, new_name: str):
+        """
+        Renames the symbol in its declaration and in every block registered as referring to it.
+        Blocks already moved into a SqliteBlockStore keep the old name.
+        :param symbol: The symbol
+        :param new_name: New name shown in scratch
+        """
+        new_key = (symbol.kind, id(symbol.owner), new_name)
+        if new_key in self.by_name:
+            raise ScratchCompilerException(
+                f"Can't rename '{symbol.name}', {symbol.kind} '{new_name}' already exists in "
+                f"'{symbol.owner.sprite_data['name']}'!")
+
+        del self.by_name[(symbol.kind, id(symbol.owner), symbol.name)]
+        self.by_name[new_key] = symbol
+        symbol.name = new_name
+
+        section = symbol.owner.sprite_data[SECTIONS[symbol.kind]]
+        if symbol.kind == SymbolKind.BROADCAST:
+            section[symbol.symbol_id] = new_name
+        else:
+            section[symbol.symbol_id][0] = new_name
+
+        for _, container, name_index in symbol.references:
+            container[name_index] = new_name
+
+    def scan_references(self):
+        """
+        Registers references of blocks that were created without SymbolReference, like VariableReference.
+        This goes through every block once, later lookups and renames don't need to.
+        """
+        for sprite in self.project.sprite_objects:
+            for block_id, block_data in sprite.sprite_data["blocks"].items():
+                if not isinstance(block_data, dict):
+                    continue
+                for input_data in block_data.get("inputs", {}).values():
+                    for item in input_data[1:] if isinstance(input_data, list) else ():
+                        if isinstance(item, list) and len(item) == 3 and item[0] in PRIMITIVES:
+                            self.register_scanned(PRIMITIVES[item[0]], item[2], sprite, block_id, item, 1)
+                for field_name, field_data in block_data.get("fields", {}).items():
+                    if field_name in FIELDS and isinstance(field_data, list) and len(field_data) == 2:
+                        self.register_scanned(FIELDS[field_name], field_data[1], sprite, block_id, field_data, 0)
+
+    def register_scanned(self, kind: SymbolKind, symbol_id: str, sprite: Sprite, block_id: str, container: list,
+                         name_index: int):
+        symbol = self.get(kind, symbol_id, sprite)
+        if symbol is None:
+            return
+        symbol.add_reference(block_id, container, name_index)
@@ -1,54 +1,430 @@
+from array import array
+from contextlib import contextmanager
 from hashlib import md5
+import copy
+import json
+import mmap
 import os
+import zipfile
 
 from .blocks import BlockStack
 from .exceptions import ScratchCompilerException
+from .image_info import SVG_READ_SIZE, BufferReader, ImageInfo, detect_image_format, read_image_info
+
+
+@contextmanager
+def map_file(file_path: str):
+    """
+    Maps the file into memory read only, so it can be hashed or copied without reading it into a python object
+    :param file_path: Path to the file
+    :return: memoryview of the file content, valid only inside the with block
+    """
+    with open(file_path, "rb") as mapped_file:
+        if os.fstat(mapped_file.fileno()).st_size == 0:
+            # empty files can't be mapped
+            yield memoryview(b"")
+            return
+        file_map = mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(file_map)
+        try:
+            yield buffer
+        except BaseException:
+            # views derived from the buffer can still be referenced by the traceback, closing the map then would
+            # replace the exception with a BufferError, the map gets closed once the views are garbage collected
+            try:
+                buffer.release()
+                file_map.close()
+            except BufferError:
+                pass
+            raise
+        buffer.release()
+        file_map.close()
+
+
+class AssetHashCache:
+    """
+        Remembers md5 hashes and image headers of asset files, so the same file isn't read again
+        until its size or modification time changes
+    """
+    def __init__(self):
+        # real path -> [(mtime, size), md5 hash or None, ImageInfo or None]
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_entry(self, file_path: str) -> (str, list):
+        """
+        :param file_path: File path to an asset
+        :return: Real path of the asset and its cache entry, values of an outdated entry are reset to None
+        """
+        real_path = os.path.realpath(file_path)
+        stat = os.stat(real_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+
+        entry = self.entries.get(real_path)
+        if entry is None or entry[0] != key:
+            entry = self.entries[real_path] = [key, None, None]
+        return real_path, entry
+
+    def get_hash(self, file_path: str) -> str:
+        """
+        :param file_path: File path to an asset to be hashed
+        :return: md5 hash as a string
+        """
+        real_path, entry = self.get_entry(file_path)
+        if entry[1] is not None:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        with map_file(real_path) as buffer:
+            entry[1] = md5(buffer).hexdigest()
+        return entry[1]
+
+    def get_image_info(self, file_path: str) -> ImageInfo:
+        """
+        :param file_path: File path to an image
+        :return: Format and dimensions of the image read from its header
+        """
+        real_path, entry = self.get_entry(file_path)
+        if entry[2] is None:
+            with open(real_path, "rb") as image_file:
+                try:
+                    entry[2] = read_image_info(image_file)
+                except ScratchCompilerException as exception:
+                    raise ScratchCompilerException(f"{file_path}: {exception}") from None
+        return entry[2]
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+ASSET_HASH_CACHE = AssetHashCache()
 
 
 def generate_md5_hash(file_path: str) -> str:
     """
-    Generates md5 hash from a file
+    Generates md5 hash from a file, hashes are cached in ASSET_HASH_CACHE
     :param file_path: File path to an image to be hashed
     :return: md5 hash as a string
     """
-    with open(file_path, "rb") as image_file:
-        return md5(image_file.read()).hexdigest()
+    return ASSET_HASH_CACHE.get_hash(file_path)
+
+
+def get_image_info(file_path: str) -> ImageInfo:
+    """
+    Reads format and dimensions from the image header, results are cached in ASSET_HASH_CACHE
+    :param file_path: File path to an image
+    :return: ImageInfo of the image
+    """
+    return ASSET_HASH_CACHE.get_image_info(file_path)
+
+
+class AssetSource:
+    """
+        Content of an asset file, either a file on disk or a buffer in memory.
+        Both kinds are hashed and written into archives from a memoryview, files are mapped into memory instead of read
+    """
+    def __init__(self, source: str | bytes | bytearray | memoryview | mmap.mmap):
+        """
+        :param source: Path to the file, or the content as any bytes-like object, which must not change afterward
+        """
+        if isinstance(source, (str, os.PathLike)):
+            self.file_path = os.fspath(source)
+            self.buffer = None
+            return
+
+        self.file_path = None
+        try:
+            buffer = memoryview(source)
+        except TypeError:
+            raise ScratchCompilerException(
+                f"Asset source has to be a file path or a bytes-like object, got {type(source).__name__}!") from None
+        if not buffer.c_contiguous:
+            raise ScratchCompilerException("Asset source buffer has to be contiguous!")
+        self.buffer = buffer if buffer.format == "B" and buffer.ndim == 1 else buffer.cast("B")
+
+    @contextmanager
+    def open_buffer(self):
+        """
+        :return: memoryview of the content, valid only inside the with block
+        """
+        if self.buffer is not None:
+            yield self.buffer
+            return
+        with map_file(self.file_path) as buffer:
+            yield buffer
+
+    def get_hash(self) -> str:
+        """
+        :return: md5 hash of the content, hashes of files are cached in ASSET_HASH_CACHE
+        """
+        if self.buffer is None:
+            return generate_md5_hash(self.file_path)
+        return md5(self.buffer).hexdigest()
+
+    def get_image_info(self) -> ImageInfo:
+        """
+        :return: Format and dimensions of the image read from its header, cached in ASSET_HASH_CACHE for files
+        """
+        if self.buffer is None:
+            return get_image_info(self.file_path)
+        return read_image_info(BufferReader(self.buffer))
+
+    def get_image_format(self) -> str | None:
+        """
+        :return: Format of the image detected from its file signature, None if it isn't a png, jpg or svg
+        """
+        with self.open_buffer() as buffer:
+            start = bytes(buffer[:SVG_READ_SIZE])
+        return detect_image_format(start)
+
+    def read(self) -> bytes:
+        """
+        :return: Copy of the content
+        """
+        with self.open_buffer() as buffer:
+            return bytes(buffer)
+
+    def write_to_archive(self, zip_file: zipfile.ZipFile, name: str):
+        """
+        Writes the content into an open archive without copying it first
+        :param zip_file: The archive
+        :param name: Name of the file inside the archive
+        """
+        with self.open_buffer() as buffer:
+            zip_file.writestr(name, buffer)
+
+    def save(self, output_path: str):
+        """
+        Writes the content into a file
+        :param output_path: Path of the file
+        """
+        with self.open_buffer() as buffer:
+            with open(output_path, "wb") as output_file:
+                output_file.write(buffer)
+
+    def __getstate__(self):
+        # memoryview can't be pickled, processes building the project get a copy of the buffer
+        return {"file_path": self.file_path, "buffer": bytes(self.buffer) if self.buffer is not None else None}
+
+    def __setstate__(self, state: dict):
+        self.file_path = state["file_path"]
+        self.buffer = memoryview(state["buffer"]) if state["buffer"] is not None else None
+
+
+class StreamedValue:
+    """
+        Base class for values inside sprite data that aren't kept as python lists or dictionaries,
+        they are written into project.json chunk by chunk when the project is built
+    """
+    def iter_json(self):
+        """
+        :return: Generator of json string chunks encoding the value
+        """
+        yield json.dumps(self.to_json_value())
+
+    def to_json_value(self):
+        """
+        :return: The value as normal python lists and dictionaries
+        """
+        raise NotImplementedError
+
+
+class ListData(StreamedValue):
+    """
+        Compact storage of scratch list contents, values are kept in an array when possible
+        and only get turned into json when project.json is written
+    """
+    CHUNK_SIZE = 4096
+
+    def __init__(self, values=()):
+        """
+        :param values: Any sequence, iterable or array of numbers or strings
+        """
+        self.values = self.compact(values)
+
+    @staticmethod
+    def compact(values):
+        """
+        Stores the values in the smallest container that keeps their json representation the same
+        :param values: Any sequence, iterable or array of numbers or strings
+        :return: array of ints, array of floats or a tuple
+        """
+        if isinstance(values, array) and values.typecode in "bBhHiIlLqQfd":
+            return values
+        if isinstance(values, (str, bytes, dict, set)):
+            raise ScratchCompilerException(f"List values have to be a sequence of items, got {type(values)}!")
+
+        values = values if isinstance(values, (list, tuple, range)) else tuple(values)
+
+        if not any(isinstance(value, bool) for value in values):
+            for typecode in ("q", "d"):
+                try:
+                    compact_values = array(typecode, values)
+                except (TypeError, OverflowError):
+                    continue
+                if typecode == "q" or all(isinstance(value, float) for value in values):
+                    return compact_values
+
+        for value in values:
+            if not isinstance(value, (str, int, float)):
+                raise ScratchCompilerException(
+                    f"Invalid list item: '{value}' typeof: {type(value)} expected 'str', 'int' or 'float'!")
+        return tuple(values)
+
+    def iter_json(self):
+        """
+        Encodes the list chunk by chunk, so the whole list never has to exist as a json string at once
+        :return: Generator of json string chunks
+        """
+        yield "["
+        for start in range(0, len(self.values), self.CHUNK_SIZE):
+            chunk = json.dumps(list(self.values[start:start + self.CHUNK_SIZE]))
+            yield (", " if start > 0 else "") + chunk[1:-1]
+        yield "]"
+
+    def to_list(self) -> list:
+        """
+        :return: The list contents as a normal python list
+        """
+        return list(self.values)
+
+    def to_json_value(self) -> list:
+        return self.to_list()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+
+def json_default(value):
+    """
+    Hook for json.dump that handles the compact containers stored inside sprite data
+    :param value: Value that json can't serialize by itself
+    :return: json serializable value
+    """
+    if isinstance(value, StreamedValue):
+        return value.to_json_value()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
 
 
 class Costume:
     """
         Abstraction of the scratch costume data
     """
-    def __init__(self, file_path: str, data_format: str, name: str, bitmap_resolution: int = 1,
-                 px_pivot: (float, float) = (0, 0)):
+    def __init__(self, file_path: str | bytes | memoryview | mmap.mmap, data_format: str | None, name: str,
+                 bitmap_resolution: int = 1, px_pivot: tuple | None = None):
         """
-        :param file_path: Path to the costume image
-        :param data_format: Format of the image
+        :param file_path: Path to the costume image, or the image content as bytes, memoryview or mmap
+        which is used without copying and must not change afterward
+        :param data_format: Format of the image, detected from the image header if None
         :param name: Name of the costume to be used
         :param bitmap_resolution: The resolution of an image, 2 meaning half of the resolution. (keep it at 1 for convenience)
-        :param px_pivot: The offset from the image top left corner determining point from where position is calculated in scratch
+        :param px_pivot: The offset from the image top left corner determining point from where position is calculated in scratch,
+        the center of the image if None.
+        When both data_format and px_pivot are given, images whose size can't be read, like svg files sized in percent,
+        are accepted and image_info is None
+        """
+        self.source = AssetSource(file_path)
+        self.original_file_path = self.source.file_path
+        try:
+            image_info = self.source.get_image_info()
+        except ScratchCompilerException as exception:
+            if data_format is None or px_pivot is None:
+                if self.original_file_path is not None:
+                    raise
+                raise ScratchCompilerException(f"Costume '{name}': {exception}") from None
+            image_info = None
+        self.set_costume_data(self.source.get_hash(), image_info, data_format, name, bitmap_resolution, px_pivot)
+
+    @classmethod
+    def from_costume_data(cls, costume_data: dict, source: str | bytes | memoryview | mmap.mmap) -> "Costume":
+        """
+        Wraps a costume of an already built target, like one from a .sprite3 file, the image isn't hashed again.
+        The costume data already has the format and rotation center, so image_info is None for images
+        whose header can't be measured, like svg files sized in percent
+        :param costume_data: Costume data from sprite.json, kept as it is
+        :param source: Path to the image or its content
+        :return: The costume
         """
-        md5_str = generate_md5_hash(file_path)
+        costume = cls.__new__(cls)
+        costume.source = AssetSource(source)
+        costume.original_file_path = costume.source.file_path
+        try:
+            costume.image_info = costume.source.get_image_info()
+        except ScratchCompilerException:
+            costume.image_info = None
+        costume.costume_data = costume_data
+        return costume
+
+    def set_costume_data(self, md5_str: str, image_info: ImageInfo | None, data_format: str | None, name: str,
+                         bitmap_resolution: int, px_pivot: tuple | None):
+        # without a readable header the format is checked by the file signature only
+        image_format = image_info.data_format if image_info is not None else self.source.get_image_format()
+        if data_format is not None and data_format.lower().replace("jpeg", "jpg") != image_format:
+            source = self.original_file_path or "the image data"
+            if image_format is None:
+                raise ScratchCompilerException(
+                    f"Costume '{name}' is declared as '{data_format}' but {source} isn't a png, jpg or svg image!")
+            raise ScratchCompilerException(
+                f"Costume '{name}' is declared as '{data_format}' but {source} is a {image_format} image!")
 
-        self.original_file_path = file_path
+        if px_pivot is None:
+            px_pivot = image_info.center
+
+        self.image_info = image_info
         self.costume_data = {
             "assetId": md5_str,
             "name": name,
             "bitmapResolution": bitmap_resolution,
-            "md5ext": f"{md5_str}.{data_format}",
-            "dataFormat": data_format,
+            "md5ext": f"{md5_str}.{image_format}",
+            "dataFormat": image_format,
             "rotationCenterX": px_pivot[0],
             "rotationCenterY": px_pivot[1]
         }
 
+    def copy(self, name: str | None = None, px_pivot: tuple | None = None) -> "Costume":
+        """
+        Creates another costume using the same image, the image isn't read or hashed again
+        :param name: Name of the new costume, the same name if None
+        :param px_pivot: Rotation center of the new costume, the same rotation center if None
+        :return: The costume
+        """
+        costume = copy.copy(self)
+        costume.costume_data = dict(self.costume_data)
+        if name is not None:
+            costume.costume_data["name"] = name
+        if px_pivot is not None:
+            costume.costume_data["rotationCenterX"], costume.costume_data["rotationCenterY"] = px_pivot
+        return costume
+
+    def read_data(self) -> bytes:
+        """
+        :return: Content of the image file
+        """
+        return self.source.read()
+
+    def write_to_archive(self, zip_file: zipfile.ZipFile):
+        """
+        Writes the hashed image into an open .sb3 archive
+        :param zip_file: The archive
+        """
+        self.source.write_to_archive(zip_file, self.costume_data["md5ext"])
+
     def save_hashed_image(self, output_dir_path: str):
         """
         Saves the hashed image inside output directory
         :param output_dir_path: The directory path
         """
-        with open(os.path.join(output_dir_path, self.costume_data['md5ext']), "wb") as write_to:
-            with open(self.original_file_path, "rb") as read_from:
-                write_to.write(read_from.read())
+        self.source.save(os.path.join(output_dir_path, self.costume_data['md5ext']))
 
 
 class Sound:
@@ -56,18 +432,20 @@ class Sound:
         Abstraction of the scratch sound data
         NOT IMPLEMENTED YET!
     """
-    def __init__(self, file_path: str, data_format: str, name: str, rate: int = 44100, sample_count: int = 1032):
+    def __init__(self, file_path: str | bytes | memoryview | mmap.mmap, data_format: str, name: str,
+                 rate: int = 44100, sample_count: int = 1032):
         """
-        TODO!!!
-        :param file_path:
-        :param data_format:
-        :param name:
-        :param rate:
-        :param sample_count:
+        :param file_path: Path to the sound file, or the sound content as bytes, memoryview or mmap
+        which is used without copying and must not change afterward
+        :param data_format: Format of the sound like "wav" or "mp3"
+        :param name: Name of the sound to be used
+        :param rate: Sample rate
+        :param sample_count: Amount of samples
         """
-        md5_str = generate_md5_hash(file_path)
+        self.source = AssetSource(file_path)
+        self.original_file_path = self.source.file_path
+        md5_str = self.source.get_hash()
 
-        self.original_file_path = file_path
         self.sound_data = {
             "assetId": md5_str,
             "name": name,
@@ -78,10 +456,35 @@ class Sound:
             "md5ext": f"{md5_str}.{data_format}"
         }
 
+    @classmethod
+    def from_sound_data(cls, sound_data: dict, source: str | bytes | memoryview | mmap.mmap) -> "Sound":
+        """
+        Wraps a sound of an already built target, like one from a .sprite3 file, the sound isn't hashed again
+        :param sound_data: Sound data from sprite.json, kept as it is
+        :param source: Path to the sound file or its content
+        :return: The sound
+        """
+        sound = cls.__new__(cls)
+        sound.source = AssetSource(source)
+        sound.original_file_path = sound.source.file_path
+        sound.sound_data = sound_data
+        return sound
+
+    def read_data(self) -> bytes:
+        """
+        :return: Content of the sound file
+        """
+        return self.source.read()
+
+    def write_to_archive(self, zip_file: zipfile.ZipFile):
+        """
+        Writes the hashed sound into an open .sb3 archive
+        :param zip_file: The archive
+        """
+        self.source.write_to_archive(zip_file, self.sound_data["md5ext"])
+
     def save_hashed_sound(self, output_dir_path: str):
-        with open(os.path.join(output_dir_path, self.sound_data['md5ext']), "wb") as write_to:
-            with open(self.original_file_path, "rb") as read_from:
-                write_to.write(read_from.read())
+        self.source.save(os.path.join(output_dir_path, self.sound_data['md5ext']))
 
 
 class Sprite:
@@ -93,6 +496,7 @@ class Sprite:
         :param name: Name of the sprite
         """
         self.costume_objects = []
+        self.sound_objects = []
         self.sprite_data = {
             "isStage": False,
             "name": name,
@@ -125,8 +529,20 @@ class Sprite:
         if len(blocks_data) < 1:
             return
 
-        for block_uuid, block_data in blocks_data.items():
-            self.sprite_data["blocks"][block_uuid] = block_data
+        blocks = self.sprite_data["blocks"]
+        if isinstance(blocks, dict):
+            blocks.update(blocks_data)
+            return
+        blocks.update_from(blocks_data.items())
+
+    def use_block_store(self, block_store) -> None:
+        """
+        Moves block data of the sprite into an out of memory block store, blocks added later are stored there too
+        :param block_store: SqliteBlockStore instance
+        """
+        stored_blocks = block_store.target_blocks()
+        stored_blocks.update_from(self.sprite_data["blocks"].items())
+        self.sprite_data["blocks"] = stored_blocks
 
     def create_variable(self, var_id: str, default_value: str | int = 0):
         """
@@ -139,6 +555,20 @@ class Sprite:
             default_value
         ]
 
+    def create_list(self, list_id: str, values=()) -> ListData:
+        """
+        Defines a local list in sprite memory
+        :param list_id: ID of the list to be referenced
+        :param values: Contents of the list at initial state of project, any sequence or array of numbers or strings
+        :return: ListData holding the contents
+        """
+        list_data = values if isinstance(values, ListData) else ListData(values)
+        self.sprite_data["lists"][list_id] = [
+            list_id,
+            list_data
+        ]
+        return list_data
+
     def add_costume(self, costume: Costume):
         """
         Adds new costume to the sprite
@@ -147,6 +577,23 @@ class Sprite:
         self.costume_objects.append(costume)
         self.sprite_data["costumes"].append(costume.costume_data)
 
+    def add_sound(self, sound: Sound):
+        """
+        Adds new sound to the sprite
+        :param sound: Sound object
+        """
+        self.sound_objects.append(sound)
+        self.sprite_data["sounds"].append(sound.sound_data)
+
+    def iter_assets(self):
+        """
+        :return: Generator of (md5ext, Costume or Sound) tuples of every costume and sound of the sprite
+        """
+        for costume in self.costume_objects:
+            yield costume.costume_data["md5ext"], costume
+        for sound in self.sound_objects:
+            yield sound.sound_data["md5ext"], sound
+
     def set_property(self, sprite_property: str, value: int | str | bool):
         """
         Sets the property of a sprite at initial state of project like "size" or "draggable"
@@ -180,6 +627,7 @@ class Stage(Sprite):
     # noinspection PyMissingConstructor
     def __init__(self):
         self.costume_objects = []
+        self.sound_objects = []
         self.sprite_data = {
             "isStage": True,
             "name": "Stage",
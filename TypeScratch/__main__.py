@@ -0,0 +1,38 @@
+import argparse
+import os
+import time
+
+from ScratchCompiler.ir import save_ir, write_sb3_from_ir
+
+from .compiler import DEFAULT_CACHE_DIR, Compiler
+from .exceptions import TypeScratchException
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiles TypeScratch modules into an .sb3 file")
+    parser.add_argument("entry", help="Path of the entry module")
+    parser.add_argument("-o", "--output", help="Path of the .sb3 file, next to the entry module by default")
+    parser.add_argument("--ir", help="Also save the linked IR to this path")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory of the compiled fragment cache")
+    parser.add_argument("--no-cache", action="store_true", help="Compile every module without using the cache")
+    args = parser.parse_args()
+
+    output_path = args.output or f"{os.path.splitext(args.entry)[0]}.sb3"
+    compiler = Compiler(cache_dir=None if args.no_cache else args.cache_dir)
+
+    start_time = time.perf_counter()
+    try:
+        ir = compiler.compile_ir(args.entry)
+    except TypeScratchException as exception:
+        parser.exit(1, f"error: {exception}\n")
+
+    if args.ir:
+        save_ir(ir, args.ir)
+    write_sb3_from_ir(ir, output_path)
+
+    print(f"Compiled {compiler.compiled_count} of {len(compiler.modules)} modules "
+          f"in {time.perf_counter() - start_time:.3f}s -> {output_path}")
+
+
+if __name__ == "__main__":
+    main()
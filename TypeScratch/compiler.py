@@ -0,0 +1,304 @@
+import json
+import os
+import tempfile
+from bisect import bisect_right
+from hashlib import sha256
+
+from ScratchCompiler.ir import IR_FORMAT, IR_VERSION, IRInputKind, NO_BLOCK, project_from_ir
+from ScratchCompiler.sb3_project import Project
+
+from .exceptions import TypeScratchException
+from .lowering import lower_module
+from .parser import parse_module, scan_imports
+
+COMPILER_VERSION = f"0.2.1+ir{IR_VERSION}"
+DEFAULT_CACHE_DIR = ".typescratch_cache"
+
+
+def hash_json(value) -> str:
+    return sha256(json.dumps(value, separators=(",", ":"), sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class FragmentCache:
+    """
+        On disk cache of compiled module fragments, one json file per cache key
+    """
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR):
+        """
+        :param directory: Directory where fragments are stored
+        """
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> dict | None:
+        """
+        :param key: Cache key of the module
+        :return: The fragment or None if it isn't cached
+        """
+        try:
+            with open(os.path.join(self.directory, f"{key}.json"), "r", encoding="utf-8") as fragment_file:
+                fragment = json.load(fragment_file)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return fragment
+
+    def put(self, key: str, fragment: dict):
+        """
+        Saves the fragment, the file is replaced atomically so concurrent compilers never read half written fragments
+        :param key: Cache key of the module
+        :param fragment: The fragment
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        file_descriptor, partial_path = tempfile.mkstemp(suffix=".partial", dir=self.directory)
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as fragment_file:
+                json.dump(fragment, fragment_file, separators=(",", ":"))
+            os.replace(partial_path, os.path.join(self.directory, f"{key}.json"))
+        except BaseException:
+            os.remove(partial_path)
+            raise
+
+
+class CompiledModule:
+    """
+        Result of compiling a single module
+    """
+    def __init__(self, file_path: str, key: str, fragment: dict, dependencies: [str], from_cache: bool):
+        """
+        :param file_path: Absolute path of the module
+        :param key: Cache key of the module
+        :param fragment: IR fragment of the module
+        :param dependencies: Absolute paths of the imported modules
+        :param from_cache: Defines if the fragment was loaded from the cache
+        """
+        self.file_path = file_path
+        self.key = key
+        self.fragment = fragment
+        self.dependencies = dependencies
+        self.from_cache = from_cache
+
+    @property
+    def exports_hash(self) -> str:
+        return hash_json(self.fragment["exports"])
+
+
+class Compiler:
+    """
+        Compiles TypeScratch modules one by one and links their fragments into a project.
+        A module is only parsed and lowered again when its source, the compiler version
+        or the constants exported by one of its imports change.
+    """
+    def __init__(self, cache_dir: str | None = DEFAULT_CACHE_DIR):
+        """
+        :param cache_dir: Directory of the fragment cache, None disables the on disk cache
+        """
+        self.cache = FragmentCache(cache_dir) if cache_dir is not None else None
+        self.modules = {}
+        self.compiled_count = 0
+
+    def compile_module(self, file_path: str, import_chain: tuple = (), checked: dict | None = None) -> CompiledModule:
+        """
+        Compiles the module and all of its imports
+        :param file_path: Path of the module
+        :param import_chain: Modules currently being compiled, used to detect import cycles
+        :param checked: Modules already checked during this compilation, so shared imports are read only once
+        :return: The compiled module
+        """
+        file_path = os.path.abspath(file_path)
+        checked = {} if checked is None else checked
+        if file_path in checked:
+            return checked[file_path]
+        if file_path in import_chain:
+            cycle = " -> ".join(os.path.basename(path) for path in import_chain + (file_path,))
+            raise TypeScratchException(f"Import cycle {cycle}", file_path)
+
+        try:
+            with open(file_path, "r", encoding="utf-8") as source_file:
+                source = source_file.read()
+        except OSError as exception:
+            raise TypeScratchException(f"Can't read module: {exception}", file_path) from exception
+
+        source_hash = sha256(source.encode("utf-8")).hexdigest()
+        cached_module = self.modules.get(file_path)
+        if cached_module is not None and cached_module.key.startswith(source_hash):
+            dependencies = [self.compile_module(path, import_chain + (file_path,), checked)
+                            for path in cached_module.dependencies]
+            if cached_module.key == self.module_key(source_hash, dependencies):
+                checked[file_path] = cached_module
+                return cached_module
+
+        module_dir = os.path.dirname(file_path)
+        dependencies = [self.compile_module(os.path.join(module_dir, module_import.path), import_chain + (file_path,),
+                                            checked)
+                        for module_import in scan_imports(source, file_path)]
+        key = self.module_key(source_hash, dependencies)
+
+        fragment = self.cache.get(key) if self.cache is not None else None
+        from_cache = fragment is not None
+        if fragment is None:
+            imported_consts = {}
+            for dependency in dependencies:
+                imported_consts.update(dependency.fragment["exports"])
+            fragment = lower_module(parse_module(source, file_path), imported_consts, file_path)
+            self.compiled_count += 1
+            if self.cache is not None:
+                self.cache.put(key, fragment)
+
+        compiled_module = CompiledModule(file_path, key, fragment,
+                                         [dependency.file_path for dependency in dependencies], from_cache)
+        self.modules[file_path] = compiled_module
+        checked[file_path] = compiled_module
+        return compiled_module
+
+    @staticmethod
+    def module_key(source_hash: str, dependencies: [CompiledModule]) -> str:
+        """
+        :param source_hash: sha256 of the module source
+        :param dependencies: Compiled imports of the module
+        :return: Cache key, starts with the source hash
+        """
+        interface_hash = hash_json([COMPILER_VERSION] + [dependency.exports_hash for dependency in dependencies])
+        return f"{source_hash}-{interface_hash[:16]}"
+
+    def collect_modules(self, entry: CompiledModule) -> [CompiledModule]:
+        """
+        :param entry: The entry module
+        :return: Every module the entry depends on, imports always come before the modules importing them
+        """
+        ordered = []
+        visited = set()
+
+        def visit(compiled_module: CompiledModule):
+            if compiled_module.file_path in visited:
+                return
+            visited.add(compiled_module.file_path)
+            for dependency_path in compiled_module.dependencies:
+                visit(self.modules[dependency_path])
+            ordered.append(compiled_module)
+
+        visit(entry)
+        return ordered
+
+    def compile_ir(self, entry_path: str) -> dict:
+        """
+        Compiles the entry module with its imports and links them into a single IR
+        :param entry_path: Path of the entry module
+        :return: The IR
+        """
+        return link_fragments(self.collect_modules(self.compile_module(entry_path)))
+
+    def compile_project(self, entry_path: str) -> Project:
+        """
+        :param entry_path: Path of the entry module
+        :return: The Project object
+        """
+        return project_from_ir(self.compile_ir(entry_path))
+
+
+def link_fragments(modules: [CompiledModule]) -> dict:
+    """
+    Merges module fragments into one IR, targets declared in multiple modules are merged by name
+    and the stage always comes first
+    :param modules: Compiled modules in link order
+    :return: The IR
+    """
+    opcodes = []
+    opcode_indexes = {}
+    assets = []
+    asset_indexes = {}
+    targets = {}
+
+    # blocks of one target have to stay next to each other, so blocks are grouped by target first
+    for compiled_module in modules:
+        fragment = compiled_module.fragment
+        module_dir = os.path.dirname(compiled_module.file_path)
+
+        opcode_map = []
+        for opcode in fragment["opcodes"]:
+            if opcode not in opcode_indexes:
+                opcode_indexes[opcode] = len(opcodes)
+                opcodes.append(opcode)
+            opcode_map.append(opcode_indexes[opcode])
+
+        asset_map = []
+        for name, file_path, *asset_rest in fragment["assets"]:
+            asset = [name, os.path.normpath(os.path.join(module_dir, file_path))] + asset_rest
+            asset_key = json.dumps(asset)
+            if asset_key not in asset_indexes:
+                asset_indexes[asset_key] = len(assets)
+                assets.append(asset)
+            asset_map.append(asset_indexes[asset_key])
+
+        # split input and field rows by the target owning their block
+        target_starts = sorted(start for start, count in (target_fragment["blocks"]
+                                                          for target_fragment in fragment["targets"]) if count > 0)
+        rows_by_start = {start: ([], []) for start in target_starts}
+        for table_index, table in enumerate(("inputs", "fields")):
+            for row in fragment[table]:
+                rows_by_start[target_starts[bisect_right(target_starts, row[0]) - 1]][table_index].append(row)
+
+        for target_fragment in fragment["targets"]:
+            name = "Stage" if target_fragment["isStage"] else target_fragment["name"]
+            target = targets.get(name)
+            if target is None:
+                target = targets[name] = {"name": name, "isStage": target_fragment["isStage"], "costumes": [],
+                                          "variables": {}, "lists": {}, "parts": []}
+            elif target["isStage"] != target_fragment["isStage"]:
+                raise TypeScratchException(f"'{name}' is declared both as a sprite and as the stage",
+                                           compiled_module.file_path)
+
+            for asset_index in target_fragment["costumes"]:
+                if asset_map[asset_index] not in target["costumes"]:
+                    target["costumes"].append(asset_map[asset_index])
+            for table in ("variables", "lists"):
+                for item_name, value in target_fragment[table].items():
+                    if target[table].get(item_name, value) != value:
+                        raise TypeScratchException(f"'{item_name}' of '{name}' is declared with different values",
+                                                   compiled_module.file_path)
+                    target[table][item_name] = value
+            start, count = target_fragment["blocks"]
+            if count > 0:
+                target["parts"].append((fragment, opcode_map, start, count, rows_by_start[start]))
+
+    ordered_targets = sorted(targets.values(), key=lambda target: not target["isStage"])
+    if not ordered_targets or not ordered_targets[0]["isStage"]:
+        ordered_targets.insert(0, {"name": "Stage", "isStage": True, "costumes": [], "variables": {}, "lists": {},
+                                   "parts": []})
+
+    blocks = []
+    inputs = []
+    fields = []
+    ir_targets = []
+    for target in ordered_targets:
+        target_start = len(blocks)
+        for fragment, opcode_map, start, count, (input_rows, field_rows) in target["parts"]:
+            offset = len(blocks) - start
+
+            def remap(block_index: int) -> int:
+                return block_index + offset if block_index != NO_BLOCK else NO_BLOCK
+
+            for opcode_index, parent, next_block, *position in fragment["blocks"][start:start + count]:
+                blocks.append([opcode_map[opcode_index], remap(parent), remap(next_block)] + position)
+            for block_index, name, kind, value in input_rows:
+                if kind in (IRInputKind.BLOCK, IRInputKind.SUBSTACK):
+                    value = remap(value)
+                inputs.append([remap(block_index), name, kind, value])
+            for block_index, name, kind, value in field_rows:
+                fields.append([remap(block_index), name, kind, value])
+
+        ir_targets.append({key: value for key, value in target.items() if key != "parts"}
+                          | {"blocks": [target_start, len(blocks) - target_start]})
+
+    return {
+        "format": IR_FORMAT,
+        "version": IR_VERSION,
+        "opcodes": opcodes,
+        "assets": assets,
+        "targets": ir_targets,
+        "blocks": blocks,
+        "inputs": inputs,
+        "fields": fields
+    }
@@ -0,0 +1,25 @@
+from ScratchCompiler.exceptions import ScratchCompilerException
+
+
+class TypeScratchException(ScratchCompilerException):
+    """
+        Exception thrown in the whole TypeScratch package if the source code can't be compiled
+    """
+    def __init__(self, message: str, file_path: str | None = None, line: int | None = None, column: int | None = None):
+        """
+        :param message: What went wrong
+        :param file_path: Path of the module
+        :param line: Line where the error happened
+        :param column: Column where the error happened
+        """
+        self.message = message
+        self.file_path = file_path
+        self.line = line
+        self.column = column
+
+        location = file_path or "<source>"
+        if line is not None:
+            location += f":{line}"
+            if column is not None:
+                location += f":{column}"
+        super().__init__(f"{location}: {message}")
@@ -0,0 +1,106 @@
+import re
+from enum import StrEnum
+
+from .exceptions import TypeScratchException
+
+
+class TokenType(StrEnum):
+    """
+        Enum class for every type of token in TypeScratch source code
+    """
+    NAME = "name"
+    NUMBER = "number"
+    STRING = "string"
+    SYMBOL = "symbol"
+    END = "end of file"
+
+
+KEYWORDS = {"import", "const", "stage", "sprite", "costume", "var", "list", "when", "if", "else", "repeat", "until",
+            "forever"}
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<whitespace>\s+)
+    |(?P<comment>//[^\n]*|/\*.*?\*/)
+    |(?P<unterminated_comment>/\*)
+    |(?P<number>\d+\.\d*|\.\d+|\d+)
+    |(?P<string>"(?:[^"\\\n]|\\.)*")
+    |(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    |(?P<symbol>\+=|-=|==|[{}()\[\];,=+\-*/<>.])
+""", re.VERBOSE | re.DOTALL)
+
+STRING_ESCAPES = {"n": "\n", "t": "\t", "\"": "\"", "\\": "\\"}
+
+
+class Token:
+    """
+        Single token of the source code
+    """
+    def __init__(self, token_type: TokenType, value, line: int, column: int):
+        """
+        :param token_type: Type of the token
+        :param value: Text of the token, parsed number or unescaped string
+        :param line: Line of the first character
+        :param column: Column of the first character
+        """
+        self.token_type = token_type
+        self.value = value
+        self.line = line
+        self.column = column
+
+    def is_symbol(self, symbol: str) -> bool:
+        return self.token_type == TokenType.SYMBOL and self.value == symbol
+
+    def is_keyword(self, keyword: str) -> bool:
+        return self.token_type == TokenType.NAME and self.value == keyword
+
+    def __str__(self):
+        return f"'{self.value}'" if self.token_type != TokenType.END else str(self.token_type)
+
+
+def unescape_string(literal: str) -> str:
+    """
+    :param literal: String literal with quotes
+    :return: Value of the string
+    """
+    return re.sub(r"\\(.)", lambda match: STRING_ESCAPES.get(match.group(1), match.group(1)), literal[1:-1])
+
+
+def tokenize(source: str, file_path: str | None = None):
+    """
+    Splits the source code into tokens lazily, so reading only the start of a module is cheap
+    :param source: The source code
+    :param file_path: Path of the module used in error messages
+    :return: Generator of tokens ending with an END token
+    """
+    position = 0
+    line = 1
+    line_start = 0
+
+    while position < len(source):
+        match = TOKEN_PATTERN.match(source, position)
+        if match is None:
+            raise TypeScratchException(f"Unexpected character '{source[position]}'", file_path, line,
+                                       position - line_start + 1)
+
+        kind = match.lastgroup
+        text = match.group()
+        column = position - line_start + 1
+
+        if kind == "unterminated_comment":
+            raise TypeScratchException("Comment is never closed", file_path, line, column)
+        if kind == "number":
+            yield Token(TokenType.NUMBER, float(text) if "." in text else int(text), line, column)
+        elif kind == "string":
+            yield Token(TokenType.STRING, unescape_string(text), line, column)
+        elif kind == "name":
+            yield Token(TokenType.NAME, text, line, column)
+        elif kind == "symbol":
+            yield Token(TokenType.SYMBOL, text, line, column)
+
+        newlines = text.count("\n")
+        if newlines:
+            line += newlines
+            line_start = position + text.rindex("\n") + 1
+        position = match.end()
+
+    yield Token(TokenType.END, None, line, position - line_start + 1)
@@ -0,0 +1,325 @@
+
+from ScratchCompiler.blocks import BlockDefinition, Definitions
+from ScratchCompiler.ir import IRBuilder, IRFieldKind, IRInputKind
+
+from .exceptions import TypeScratchException
+from .parser import (Assign, BinaryOperation, Call, ConstDeclaration, Forever, If, Index, Literal, Module, Name, Node,
+                     Repeat, RepeatUntil, TargetDeclaration)
+
+OPERATORS = {
+    "+": (Definitions.MATH_ADD, lambda left, right: left + right),
+    "-": (Definitions.MATH_SUBTRACT, lambda left, right: left - right),
+    "*": (Definitions.MATH_MULTIPLY, lambda left, right: left * right),
+    "/": (Definitions.MATH_DIVIDE, lambda left, right: left / right if right != 0 else None),
+    ">": (Definitions.OPERATOR_GT, None),
+    "<": (Definitions.OPERATOR_LT, None),
+    "==": (Definitions.OPERATOR_EQUALS, None),
+}
+
+# name: (definition, input names of the arguments, defines if the first argument is a list)
+BUILTIN_COMMANDS = {
+    "move": (Definitions.MOVE_STEPS, ["STEPS"], False),
+    "turnRight": (Definitions.TURN_RIGHT, ["DEGREES"], False),
+    "turnLeft": (Definitions.TURN_LEFT, ["DEGREES"], False),
+    "goTo": (Definitions.GOTO_XY, ["X", "Y"], False),
+    "say": (Definitions.SAY, ["MESSAGE"], False),
+    "setSize": (Definitions.LOOKS_SET_SIZE_TO, ["SIZE"], False),
+    "push": (Definitions.ADD_TO_LIST, ["ITEM"], True),
+    "delete": (Definitions.DELETE_OF_LIST, ["INDEX"], True),
+    "clear": (Definitions.DELETE_ALL_OF_LIST, [], True),
+    "insert": (Definitions.INSERT_AT_LIST, ["INDEX", "ITEM"], True),
+    "showList": (Definitions.SHOW_LIST, [], True),
+    "hideList": (Definitions.HIDE_LIST, [], True),
+}
+
+BUILTIN_REPORTERS = {
+    "length": (Definitions.LENGTH_OF_LIST, [], True),
+    "indexOf": (Definitions.ITEM_NUM_OF_LIST, ["ITEM"], True),
+    "contains": (Definitions.LIST_CONTAINS_ITEM, ["ITEM"], True),
+}
+
+
+def format_number(value: int | float) -> str:
+    """
+    :param value: Number from the source code
+    :return: The number as scratch stores number literals
+    """
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def join_text(value: int | float | str) -> str:
+    """
+    :param value: Folded operand of a string "+"
+    :return: The operand as scratch joins it
+    """
+    return value if isinstance(value, str) else format_number(value)
+
+
+class Lowering:
+    """
+        Turns the AST of a single module into an IR fragment, see IR.md.
+        Modules are lowered independently, the only thing known about other modules are the constants they export.
+    """
+    def __init__(self, module: Module, imported_consts: dict, file_path: str | None = None):
+        """
+        :param module: The module AST
+        :param imported_consts: Constants exported by the imported modules
+        :param file_path: Path of the module used in error messages
+        """
+        self.module = module
+        self.file_path = file_path
+        self.consts = dict(imported_consts)
+        self.exports = {}
+        self.builder = IRBuilder()
+        self.asset_indexes = {}
+        self.list_names = set()
+
+    def error(self, message: str, node: Node) -> TypeScratchException:
+        return TypeScratchException(message, self.file_path, node.line)
+
+    def lower(self) -> dict:
+        """
+        :return: The IR fragment of the module with 'exports' and 'imports' added
+        """
+        for const in self.module.consts:
+            self.lower_const(const)
+        for target in self.module.targets:
+            self.lower_target(target)
+
+        fragment = self.builder.to_dict()
+        fragment["exports"] = self.exports
+        fragment["imports"] = [module_import.path for module_import in self.module.imports]
+        return fragment
+
+    def lower_const(self, const: ConstDeclaration):
+        if const.name in self.exports:
+            raise self.error(f"Constant '{const.name}' is already defined", const)
+        value = self.fold(const.value)
+        if value is None:
+            raise self.error(f"Value of constant '{const.name}' has to be known at compile time", const)
+        self.consts[const.name] = value
+        self.exports[const.name] = value
+
+    def fold(self, expression: Node) -> int | float | str | None:
+        """
+        Evaluates an expression at compile time
+        :param expression: The expression
+        :return: Value of the expression or None if it can only be known when the project runs
+        """
+        if isinstance(expression, Literal):
+            return expression.value
+        if isinstance(expression, Name):
+            return self.consts.get(expression.name)
+        if isinstance(expression, BinaryOperation):
+            evaluate = OPERATORS[expression.operator][1]
+            left, right = self.fold(expression.left), self.fold(expression.right)
+            if expression.operator == "+" and None not in (left, right) and \
+                    any(isinstance(value, str) for value in (left, right)):
+                return join_text(left) + join_text(right)
+            if evaluate is None or not all(isinstance(value, (int, float)) for value in (left, right)):
+                return None
+            return evaluate(left, right)
+        return None
+
+    def is_text(self, expression: Node) -> bool:
+        """
+        :param expression: The expression
+        :return: Defines if the expression is known to be a string, "+" joins the operands then
+        """
+        if isinstance(expression, BinaryOperation):
+            return expression.operator == "+" and (self.is_text(expression.left) or self.is_text(expression.right))
+        return isinstance(self.fold(expression), str)
+
+    def fold_required(self, expression: Node, what: str) -> int | float | str:
+        value = self.fold(expression)
+        if value is None:
+            raise self.error(f"{what} has to be known at compile time", expression)
+        return value
+
+    def lower_target(self, target: TargetDeclaration):
+        costumes = []
+        for costume in target.costumes:
+            pivot = None
+            if costume.pivot is not None:
+                pivot = tuple(self.fold_required(value, "Costume pivot") for value in costume.pivot)
+            key = (costume.name, costume.file_path, pivot)
+            if key not in self.asset_indexes:
+                self.asset_indexes[key] = self.builder.add_asset(costume.name, costume.file_path, None,
+                                                                 px_pivot=pivot)
+            costumes.append(self.asset_indexes[key])
+
+        variables = {variable.name: self.fold_required(variable.value, f"Initial value of '{variable.name}'")
+                     for variable in target.variables}
+        lists = {list_declaration.name: [self.fold_required(value, f"Initial value of '{list_declaration.name}'")
+                                         for value in list_declaration.values]
+                 for list_declaration in target.lists}
+        self.list_names = set(lists)
+
+        self.builder.add_target(target.name, is_stage=target.is_stage, costumes=costumes, variables=variables,
+                                lists=lists)
+
+        for script in target.scripts:
+            hat_block = self.builder.add_block(Definitions.WHEN_FLAG_CLICKED.opcode)
+            self.builder.chain([hat_block] + self.lower_statements(script.body))
+
+    def add_block(self, definition: BlockDefinition) -> int:
+        return self.builder.add_block(definition.opcode)
+
+    def lower_statements(self, statements: [Node]) -> [int]:
+        """
+        :param statements: Statements in order
+        :return: Indexes of the blocks, one per statement
+        """
+        block_indexes = []
+        for statement_index, statement in enumerate(statements):
+            if isinstance(statement, Forever) and statement_index < len(statements) - 1:
+                raise self.error("Statements after 'forever' would never run", statements[statement_index + 1])
+            block_indexes.append(self.lower_statement(statement))
+        return block_indexes
+
+    def lower_substack(self, block: int, input_name: str, statements: [Node]):
+        block_indexes = self.lower_statements(statements)
+        if not block_indexes:
+            return
+        self.builder.chain(block_indexes)
+        self.builder.add_input(block, input_name, IRInputKind.SUBSTACK, block_indexes[0])
+
+    def lower_statement(self, statement: Node) -> int:
+        if isinstance(statement, If):
+            definition = Definitions.CONTROL_IF if statement.else_body is None else Definitions.CONTROL_IF_ELSE
+            block = self.add_block(definition)
+            self.lower_condition(block, statement.condition)
+            self.lower_substack(block, "SUBSTACK", statement.body)
+            if statement.else_body is not None:
+                self.lower_substack(block, "SUBSTACK2", statement.else_body)
+            return block
+
+        if isinstance(statement, Repeat):
+            block = self.add_block(Definitions.CONTROL_REPEAT)
+            self.lower_input(block, "TIMES", statement.times)
+            self.lower_substack(block, "SUBSTACK", statement.body)
+            return block
+
+        if isinstance(statement, RepeatUntil):
+            block = self.add_block(Definitions.CONTROL_REPEAT_UNTIL)
+            self.lower_condition(block, statement.condition)
+            self.lower_substack(block, "SUBSTACK", statement.body)
+            return block
+
+        if isinstance(statement, Forever):
+            block = self.add_block(Definitions.CONTROL_FOREVER)
+            self.lower_substack(block, "SUBSTACK", statement.body)
+            return block
+
+        if isinstance(statement, Assign):
+            return self.lower_assign(statement)
+
+        if isinstance(statement, Call):
+            if statement.name not in BUILTIN_COMMANDS:
+                raise self.error(f"Unknown command '{statement.name}'", statement)
+            return self.lower_call(statement, *BUILTIN_COMMANDS[statement.name])
+
+        raise self.error(f"Unsupported statement {type(statement).__name__}", statement)
+
+    def lower_assign(self, statement: Assign) -> int:
+        if statement.name in self.consts:
+            raise self.error(f"Can't assign to constant '{statement.name}'", statement)
+
+        if statement.index is not None:
+            block = self.add_block(Definitions.REPLACE_ITEM_OF_LIST)
+            self.lower_input(block, "INDEX", statement.index)
+            self.lower_input(block, "ITEM", statement.value)
+            self.builder.add_field(block, "LIST", IRFieldKind.LIST, statement.name)
+            return block
+
+        if statement.name in self.list_names:
+            raise self.error(f"Can't assign to list '{statement.name}', use push, insert or an index", statement)
+
+        value = statement.value
+        if statement.operator == "-=":
+            value = BinaryOperation("-", Literal(0, statement.line), value, statement.line)
+
+        definition = Definitions.SET_VARIABLE_TO if statement.operator == "=" else Definitions.CHANGE_VARIABLE_BY
+        block = self.add_block(definition)
+        self.lower_input(block, "VALUE", value)
+        self.builder.add_field(block, "VARIABLE", IRFieldKind.VARIABLE, statement.name)
+        return block
+
+    def lower_call(self, call: Call, definition: BlockDefinition, input_names: [str], uses_list: bool) -> int:
+        arguments = call.arguments
+        expected_count = len(input_names) + int(uses_list)
+        if len(arguments) != expected_count:
+            raise self.error(f"'{call.name}' expects {expected_count} arguments, got {len(arguments)}", call)
+
+        block = self.add_block(definition)
+        if uses_list:
+            list_argument = arguments[0]
+            if not isinstance(list_argument, Name):
+                raise self.error(f"First argument of '{call.name}' has to be a list name", call)
+            self.builder.add_field(block, "LIST", IRFieldKind.LIST, list_argument.name)
+            arguments = arguments[1:]
+
+        for input_name, argument in zip(input_names, arguments):
+            self.lower_input(block, input_name, argument)
+        return block
+
+    def lower_condition(self, block: int, condition: Node):
+        is_comparison = isinstance(condition, BinaryOperation) and OPERATORS[condition.operator][1] is None
+        is_contains = isinstance(condition, Call) and condition.name == "contains"
+        if not (is_comparison or is_contains):
+            raise self.error("Condition has to be a comparison or 'contains'", condition)
+        self.lower_input(block, "CONDITION", condition)
+
+    def lower_input(self, block: int, input_name: str, expression: Node):
+        kind, value = self.lower_expression(expression)
+        self.builder.add_input(block, input_name, kind, value)
+
+    def lower_expression(self, expression: Node) -> (IRInputKind, object):
+        """
+        :param expression: The expression
+        :return: Kind and value of the IR input row
+        """
+        value = self.fold(expression)
+        if isinstance(value, str):
+            return IRInputKind.STRING, value
+        if value is not None:
+            return IRInputKind.NUMBER, format_number(value)
+
+        if isinstance(expression, Name):
+            if expression.name in self.list_names:
+                return IRInputKind.LIST, expression.name
+            return IRInputKind.VARIABLE, expression.name
+
+        if isinstance(expression, BinaryOperation):
+            definition = OPERATORS[expression.operator][0]
+            if expression.operator == "+" and (self.is_text(expression.left) or self.is_text(expression.right)):
+                definition = Definitions.OPERATOR_JOIN
+            block = self.add_block(definition)
+            for input_name, operand in zip(definition.inputs, (expression.left, expression.right)):
+                self.lower_input(block, input_name, operand)
+            return IRInputKind.BLOCK, block
+
+        if isinstance(expression, Index):
+            block = self.add_block(Definitions.ITEM_OF_LIST)
+            self.lower_input(block, "INDEX", expression.index)
+            self.builder.add_field(block, "LIST", IRFieldKind.LIST, expression.list_name)
+            return IRInputKind.BLOCK, block
+
+        if isinstance(expression, Call):
+            if expression.name not in BUILTIN_REPORTERS:
+                raise self.error(f"Unknown reporter '{expression.name}'", expression)
+            return IRInputKind.BLOCK, self.lower_call(expression, *BUILTIN_REPORTERS[expression.name])
+
+        raise self.error(f"Unsupported expression {type(expression).__name__}", expression)
+
+
+def lower_module(module: Module, imported_consts: dict, file_path: str | None = None) -> dict:
+    """
+    :param module: The module AST
+    :param imported_consts: Constants exported by the imported modules
+    :param file_path: Path of the module used in error messages
+    :return: The IR fragment of the module
+    """
+    return Lowering(module, imported_consts, file_path).lower()
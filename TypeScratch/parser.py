@@ -0,0 +1,424 @@
+from .exceptions import TypeScratchException
+from .lexer import KEYWORDS, Token, TokenType, tokenize
+
+
+class Node:
+    """
+        Base class of every AST node, remembers where in the source it starts
+    """
+    def __init__(self, line: int):
+        self.line = line
+
+
+class Literal(Node):
+    def __init__(self, value: int | float | str, line: int):
+        super().__init__(line)
+        self.value = value
+
+
+class Name(Node):
+    def __init__(self, name: str, line: int):
+        super().__init__(line)
+        self.name = name
+
+
+class BinaryOperation(Node):
+    def __init__(self, operator: str, left: Node, right: Node, line: int):
+        super().__init__(line)
+        self.operator = operator
+        self.left = left
+        self.right = right
+
+
+class Index(Node):
+    """
+        Reading an item of a list like table[3]
+    """
+    def __init__(self, list_name: str, index: Node, line: int):
+        super().__init__(line)
+        self.list_name = list_name
+        self.index = index
+
+
+class Call(Node):
+    """
+        Call of a builtin command or reporter like say("hi") or length(table)
+    """
+    def __init__(self, name: str, arguments: [Node], line: int):
+        super().__init__(line)
+        self.name = name
+        self.arguments = arguments
+
+
+class Assign(Node):
+    """
+        Variable assignment with '=', '+=' or '-=', or list item assignment if index is set
+    """
+    def __init__(self, name: str, operator: str, value: Node, line: int, index: Node | None = None):
+        super().__init__(line)
+        self.name = name
+        self.operator = operator
+        self.value = value
+        self.index = index
+
+
+class If(Node):
+    def __init__(self, condition: Node, body: [Node], else_body: list | None, line: int):
+        super().__init__(line)
+        self.condition = condition
+        self.body = body
+        self.else_body = else_body
+
+
+class Repeat(Node):
+    def __init__(self, times: Node, body: [Node], line: int):
+        super().__init__(line)
+        self.times = times
+        self.body = body
+
+
+class RepeatUntil(Node):
+    def __init__(self, condition: Node, body: [Node], line: int):
+        super().__init__(line)
+        self.condition = condition
+        self.body = body
+
+
+class Forever(Node):
+    def __init__(self, body: [Node], line: int):
+        super().__init__(line)
+        self.body = body
+
+
+class Script(Node):
+    """
+        Statements started by an event like 'when flag { ... }'
+    """
+    def __init__(self, event: str, body: [Node], line: int):
+        super().__init__(line)
+        self.event = event
+        self.body = body
+
+
+class CostumeDeclaration(Node):
+    def __init__(self, name: str, file_path: str, pivot: tuple | None, line: int):
+        super().__init__(line)
+        self.name = name
+        self.file_path = file_path
+        self.pivot = pivot
+
+
+class VariableDeclaration(Node):
+    def __init__(self, name: str, value: Node, line: int):
+        super().__init__(line)
+        self.name = name
+        self.value = value
+
+
+class ListDeclaration(Node):
+    def __init__(self, name: str, values: [Node], line: int):
+        super().__init__(line)
+        self.name = name
+        self.values = values
+
+
+class TargetDeclaration(Node):
+    """
+        'stage { ... }' or 'sprite Name { ... }', one target can be declared in multiple modules
+    """
+    def __init__(self, name: str, is_stage: bool, line: int):
+        super().__init__(line)
+        self.name = name
+        self.is_stage = is_stage
+        self.costumes = []
+        self.variables = []
+        self.lists = []
+        self.scripts = []
+
+
+class ConstDeclaration(Node):
+    def __init__(self, name: str, value: Node, line: int):
+        super().__init__(line)
+        self.name = name
+        self.value = value
+
+
+class Import(Node):
+    def __init__(self, path: str, line: int):
+        super().__init__(line)
+        self.path = path
+
+
+class Module(Node):
+    def __init__(self, imports: [Import], consts: [ConstDeclaration], targets: [TargetDeclaration]):
+        super().__init__(1)
+        self.imports = imports
+        self.consts = consts
+        self.targets = targets
+
+
+class Parser:
+    """
+        Recursive descent parser turning TypeScratch source code into a Module AST
+    """
+    def __init__(self, source: str, file_path: str | None = None):
+        """
+        :param source: The source code
+        :param file_path: Path of the module used in error messages
+        """
+        self.file_path = file_path
+        self.tokens = tokenize(source, file_path)
+        self.current: Token = next(self.tokens)
+
+    def error(self, message: str, token: Token | None = None) -> TypeScratchException:
+        token = token or self.current
+        return TypeScratchException(message, self.file_path, token.line, token.column)
+
+    def advance(self) -> Token:
+        token = self.current
+        if token.token_type != TokenType.END:
+            self.current = next(self.tokens)
+        return token
+
+    def expect_symbol(self, symbol: str) -> Token:
+        if not self.current.is_symbol(symbol):
+            raise self.error(f"Expected '{symbol}' but got {self.current}")
+        return self.advance()
+
+    def expect_keyword(self, keyword: str) -> Token:
+        if not self.current.is_keyword(keyword):
+            raise self.error(f"Expected '{keyword}' but got {self.current}")
+        return self.advance()
+
+    def expect_name(self) -> str:
+        if self.current.token_type != TokenType.NAME or self.current.value in KEYWORDS:
+            raise self.error(f"Expected a name but got {self.current}")
+        return self.advance().value
+
+    def expect_string(self) -> str:
+        if self.current.token_type != TokenType.STRING:
+            raise self.error(f"Expected a string but got {self.current}")
+        return self.advance().value
+
+    def parse_imports(self) -> [Import]:
+        """
+        Parses only the imports at the start of the module
+        :return: List of imports
+        """
+        imports = []
+        while self.current.is_keyword("import"):
+            line = self.advance().line
+            imports.append(Import(self.expect_string(), line))
+            self.expect_symbol(";")
+        return imports
+
+    def parse_module(self) -> Module:
+        imports = self.parse_imports()
+        consts = []
+        targets = []
+
+        while self.current.token_type != TokenType.END:
+            if self.current.is_keyword("const"):
+                line = self.advance().line
+                name = self.expect_name()
+                self.expect_symbol("=")
+                consts.append(ConstDeclaration(name, self.parse_expression(), line))
+                self.expect_symbol(";")
+            elif self.current.is_keyword("stage"):
+                line = self.advance().line
+                targets.append(self.parse_target_body(TargetDeclaration("Stage", True, line)))
+            elif self.current.is_keyword("sprite"):
+                line = self.advance().line
+                targets.append(self.parse_target_body(TargetDeclaration(self.expect_name(), False, line)))
+            elif self.current.is_keyword("import"):
+                raise self.error("Imports have to be at the start of the module")
+            else:
+                raise self.error(f"Expected 'const', 'stage' or 'sprite' but got {self.current}")
+
+        return Module(imports, consts, targets)
+
+    def parse_target_body(self, target: TargetDeclaration) -> TargetDeclaration:
+        self.expect_symbol("{")
+
+        while not self.current.is_symbol("}"):
+            line = self.current.line
+            if self.current.is_keyword("costume"):
+                self.advance()
+                name = self.expect_name()
+                self.expect_symbol("=")
+                file_path = self.expect_string()
+                pivot = None
+                if self.current.is_symbol("("):
+                    self.advance()
+                    pivot_x = self.parse_expression()
+                    self.expect_symbol(",")
+                    pivot = (pivot_x, self.parse_expression())
+                    self.expect_symbol(")")
+                self.expect_symbol(";")
+                target.costumes.append(CostumeDeclaration(name, file_path, pivot, line))
+            elif self.current.is_keyword("var"):
+                self.advance()
+                name = self.expect_name()
+                self.expect_symbol("=")
+                target.variables.append(VariableDeclaration(name, self.parse_expression(), line))
+                self.expect_symbol(";")
+            elif self.current.is_keyword("list"):
+                self.advance()
+                name = self.expect_name()
+                self.expect_symbol("=")
+                self.expect_symbol("[")
+                values = self.parse_arguments("]")
+                self.expect_symbol(";")
+                target.lists.append(ListDeclaration(name, values, line))
+            elif self.current.is_keyword("when"):
+                self.advance()
+                event = self.expect_name()
+                if event != "flag":
+                    raise self.error(f"Unknown event '{event}', only 'flag' is supported")
+                target.scripts.append(Script(event, self.parse_block(), line))
+            elif self.current.token_type == TokenType.END:
+                raise self.error(f"Target '{target.name}' is never closed")
+            else:
+                raise self.error(f"Expected 'costume', 'var', 'list' or 'when' but got {self.current}")
+
+        self.advance()
+        return target
+
+    def parse_block(self) -> [Node]:
+        self.expect_symbol("{")
+        statements = []
+        while not self.current.is_symbol("}"):
+            if self.current.token_type == TokenType.END:
+                raise self.error("Block is never closed")
+            statements.append(self.parse_statement())
+        self.advance()
+        return statements
+
+    def parse_statement(self) -> Node:
+        token = self.current
+
+        if token.is_keyword("if"):
+            self.advance()
+            condition = self.parse_condition()
+            body = self.parse_block()
+            else_body = None
+            if self.current.is_keyword("else"):
+                self.advance()
+                else_body = [self.parse_statement()] if self.current.is_keyword("if") else self.parse_block()
+            return If(condition, body, else_body, token.line)
+
+        if token.is_keyword("repeat"):
+            self.advance()
+            if self.current.is_keyword("until"):
+                self.advance()
+                return RepeatUntil(self.parse_condition(), self.parse_block(), token.line)
+            return Repeat(self.parse_condition(), self.parse_block(), token.line)
+
+        if token.is_keyword("forever"):
+            self.advance()
+            return Forever(self.parse_block(), token.line)
+
+        name = self.expect_name()
+
+        if self.current.is_symbol("("):
+            self.advance()
+            statement = Call(name, self.parse_arguments(")"), token.line)
+        elif self.current.is_symbol("["):
+            self.advance()
+            index = self.parse_expression()
+            self.expect_symbol("]")
+            self.expect_symbol("=")
+            statement = Assign(name, "=", self.parse_expression(), token.line, index=index)
+        elif self.current.token_type == TokenType.SYMBOL and self.current.value in ("=", "+=", "-="):
+            operator = self.advance().value
+            statement = Assign(name, operator, self.parse_expression(), token.line)
+        else:
+            raise self.error(f"Expected a call or an assignment but got {self.current}")
+
+        self.expect_symbol(";")
+        return statement
+
+    def parse_condition(self) -> Node:
+        self.expect_symbol("(")
+        expression = self.parse_expression()
+        self.expect_symbol(")")
+        return expression
+
+    def parse_arguments(self, closing_symbol: str) -> [Node]:
+        arguments = []
+        while not self.current.is_symbol(closing_symbol):
+            arguments.append(self.parse_expression())
+            if not self.current.is_symbol(closing_symbol):
+                self.expect_symbol(",")
+        self.advance()
+        return arguments
+
+    def parse_expression(self) -> Node:
+        left = self.parse_additive()
+        if self.current.token_type == TokenType.SYMBOL and self.current.value in (">", "<", "=="):
+            operator = self.advance()
+            return BinaryOperation(operator.value, left, self.parse_additive(), operator.line)
+        return left
+
+    def parse_additive(self) -> Node:
+        left = self.parse_term()
+        while self.current.token_type == TokenType.SYMBOL and self.current.value in ("+", "-"):
+            operator = self.advance()
+            left = BinaryOperation(operator.value, left, self.parse_term(), operator.line)
+        return left
+
+    def parse_term(self) -> Node:
+        left = self.parse_unary()
+        while self.current.token_type == TokenType.SYMBOL and self.current.value in ("*", "/"):
+            operator = self.advance()
+            left = BinaryOperation(operator.value, left, self.parse_unary(), operator.line)
+        return left
+
+    def parse_unary(self) -> Node:
+        if self.current.is_symbol("-"):
+            operator = self.advance()
+            operand = self.parse_unary()
+            if isinstance(operand, Literal) and not isinstance(operand.value, str):
+                return Literal(-operand.value, operator.line)
+            return BinaryOperation("-", Literal(0, operator.line), operand, operator.line)
+        return self.parse_primary()
+
+    def parse_primary(self) -> Node:
+        token = self.current
+
+        if token.token_type in (TokenType.NUMBER, TokenType.STRING):
+            self.advance()
+            return Literal(token.value, token.line)
+
+        if token.is_symbol("("):
+            return self.parse_condition()
+
+        name = self.expect_name()
+        if self.current.is_symbol("("):
+            self.advance()
+            return Call(name, self.parse_arguments(")"), token.line)
+        if self.current.is_symbol("["):
+            self.advance()
+            index = self.parse_expression()
+            self.expect_symbol("]")
+            return Index(name, index, token.line)
+        return Name(name, token.line)
+
+
+def parse_module(source: str, file_path: str | None = None) -> Module:
+    """
+    :param source: The source code
+    :param file_path: Path of the module used in error messages
+    :return: The module AST
+    """
+    return Parser(source, file_path).parse_module()
+
+
+def scan_imports(source: str, file_path: str | None = None) -> [Import]:
+    """
+    Reads only the imports at the start of the module without parsing the rest
+    :param source: The source code
+    :param file_path: Path of the module used in error messages
+    :return: List of imports
+    """
+    return Parser(source, file_path).parse_imports()
@@ -19,6 +19,10 @@ def main():
         project = tests.fields_test()
         project = tests.inputs_test()
         project = tests.control_test()
+        project = tests.lists_test()
+        project = tests.sprite_sheet_test()
+        project = tests.sprite3_test()
+        project = tests.language_test()
     """
     project = tests.control_test2()
     build_sb3_from_project(project, "project_result", temp_folder_path=TEMP_FOLDER_PATH,
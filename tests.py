@@ -1,6 +1,8 @@
 import os
+from array import array
 
-from ScratchCompiler import target, sb3_project, blocks
+from ScratchCompiler import target, sb3_project, blocks, ir, sprite_sheet
+from TypeScratch.compiler import Compiler
 
 SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 BUILD_FOLDER = os.path.join(SCRIPT_PATH, "build")
@@ -230,3 +232,129 @@ def control_test2() -> sb3_project.Project:
     project.add_sprite(ducky)
 
     return project
+
+
+def lists_test() -> sb3_project.Project:
+    """
+        This returns a project with a sprite containing a big lookup table list and blocks that read from it
+    """
+    stage = target.Stage()
+    stage.add_costume(empty_background)
+
+    ducky = target.Sprite(name="Ducky")
+    ducky.add_costume(ducky_costume)
+
+    ducky.create_list("squares", array("q", (index * index for index in range(100000))))
+
+    start_block = blocks.Block(blocks.Definitions.WHEN_FLAG_CLICKED)
+
+    item_block = blocks.Block(blocks.Definitions.ITEM_OF_LIST)
+    item_block.set_input_value("INDEX", blocks.Input("12"))
+    item_block.set_field_value("LIST", blocks.FieldInput(blocks.ListReference("squares", is_field_selector=True)))
+
+    say_block = blocks.Block(blocks.Definitions.SAY)
+    say_block.set_input_value("MESSAGE", blocks.Input(item_block))
+
+    block_stack = blocks.BlockStack()
+    block_stack.add_block(start_block)
+    block_stack.add_block(say_block)
+    block_stack.add_block(item_block, auto_parent=False)
+
+    ducky.add_block_stack(block_stack)
+
+    project = sb3_project.Project()
+    project.add_sprite(stage)
+    project.add_sprite(ducky)
+
+    return project
+
+
+def sprite_sheet_test() -> sb3_project.Project:
+    """
+        This returns a project with a sprite animated by costumes sliced from a sprite sheet,
+        ducky.png is split into a 2x2 grid of frames, identical frames share one asset
+    """
+    stage = target.Stage()
+    stage.add_costume(empty_background)
+
+    ducky = target.Sprite(name="Ducky")
+    sheet = sprite_sheet.SpriteSheet(os.path.join(SCRIPT_PATH, "assets", "ducky.png"))
+    sheet.add_to_sprite(ducky, sheet.grid(16, 16, name="DuckyPart"))
+
+    block_stack = blocks.BlockStack()
+    block_stack.add_block(blocks.Block(blocks.Definitions.WHEN_FLAG_CLICKED))
+    forever_block = blocks.Block(blocks.Definitions.CONTROL_FOREVER)
+    block_stack.add_block(forever_block)
+
+    forever_substack = blocks.BlockStack()
+    forever_substack.add_block(blocks.Block(blocks.Definitions.NEXT_COSTUME))
+    wait_block = blocks.Block(blocks.Definitions.CONTROL_WAIT)
+    wait_block.set_input_value("DURATION", blocks.Input("0.2"))
+    forever_substack.add_block(wait_block)
+    forever_block.set_input_value("SUBSTACK", blocks.Input(forever_substack.first_block))
+
+    ducky.add_block_stack(block_stack)
+    ducky.add_block_stack(forever_substack)
+
+    project = sb3_project.Project()
+    project.add_sprite(stage)
+    project.add_sprite(ducky)
+
+    return project
+
+
+def sprite3_test() -> sb3_project.Project:
+    """
+        This returns a project with the sprite of control_test2 exported as a .sprite3 file and imported twice,
+        the second copy gets new block and variable IDs and a new name because the first one already uses them
+    """
+    sprite3_path = os.path.join(BUILD_FOLDER, "Ducky.sprite3")
+    os.makedirs(BUILD_FOLDER, exist_ok=True)
+    sb3_project.write_sprite3(control_test2().sprite_objects[1], sprite3_path)
+
+    stage = target.Stage()
+    stage.add_costume(empty_background)
+
+    project = sb3_project.Project()
+    project.add_sprite(stage)
+    project.import_sprite3(sprite3_path)
+    project.import_sprite3(sprite3_path).set_property("x", 100)
+
+    return project
+
+
+def ir_test() -> sb3_project.Project:
+    """
+        This returns the same project as control_test2 but loaded from IR tables instead of Block objects
+    """
+    builder = ir.IRBuilder()
+    background = builder.add_asset("EMPTY_BACKGROUND", "assets/empty_background.svg", "svg")
+    ducky = builder.add_asset("DuckyIdle", "assets/ducky.png", "png", px_pivot=(16, 16))
+
+    builder.add_target("Stage", is_stage=True, costumes=[background])
+    builder.add_target("Sprite", costumes=[ducky], variables={"counter": 0})
+
+    start_block, repeat_block, forever_block = builder.add_stack(
+        ["event_whenflagclicked", "control_repeat", "control_forever"])
+    builder.add_input(repeat_block, "TIMES", ir.IRInputKind.NUMBER, "100")
+
+    change_variable_by, say_block = builder.add_stack(["data_changevariableby", "looks_say"])
+    builder.add_input(change_variable_by, "VALUE", ir.IRInputKind.NUMBER, "1")
+    builder.add_field(change_variable_by, "VARIABLE", ir.IRFieldKind.VARIABLE, "counter")
+    builder.add_input(say_block, "MESSAGE", ir.IRInputKind.VARIABLE, "counter")
+    builder.add_input(repeat_block, "SUBSTACK", ir.IRInputKind.BLOCK, change_variable_by)
+
+    turn_right_block, = builder.add_stack(["motion_turnright"])
+    builder.add_input(turn_right_block, "DEGREES", ir.IRInputKind.NUMBER, "15")
+    builder.add_input(forever_block, "SUBSTACK", ir.IRInputKind.BLOCK, turn_right_block)
+
+    return ir.project_from_ir(builder.to_dict(), base_path=SCRIPT_PATH)
+
+
+def language_test() -> sb3_project.Project:
+    """
+        This returns a project compiled from the TypeScratch modules inside the examples folder,
+        compiled modules are cached so only changed modules get compiled again
+    """
+    compiler = Compiler(cache_dir=os.path.join(BUILD_FOLDER, "typescratch_cache"))
+    return compiler.compile_project(os.path.join(SCRIPT_PATH, "examples", "ducky.tscratch"))